@@ -0,0 +1,296 @@
+"""Synthetic benchmarks for :mod:`mayatools.binary`.
+
+Files with a configurable layout, chunk count, nesting depth and payload size
+are generated (in a child process) in a temporary directory, and then parsed,
+decoded and dumped in a fresh interpreter per benchmark so that peak memory
+can be measured in isolation. Results may be saved as JSON, and compared with
+previous runs::
+
+    python -m mayatools.benchmark --chunks 100000 --output before.json
+    # Make changes...
+    python -m mayatools.benchmark --chunks 100000 --compare before.json
+
+"""
+
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import binary
+
+
+def generate(layout='cache', chunks=1000, depth=1, payload_size=1024, group_type='FOR4'):
+    """Generate a synthetic :class:`.binary.Node` graph.
+
+    :param str layout: ``"cache"`` for a ``CACH`` header followed by a
+        ``MYCH`` group of ``CHNM``/``SIZE``/``FBCA`` channels (as in cache
+        frames), or ``"nested"`` for chunks spread evenly across a tree of
+        groups.
+    :param int chunks: Roughly how many chunks to generate.
+    :param int depth: How deeply to nest groups (only for ``"nested"``).
+    :param int payload_size: The size in bytes of each data payload.
+    :param str group_type: The group type, e.g. ``"FOR4"`` or ``"FOR8"``.
+
+    """
+
+    root = binary.Node()
+    floats = [float(i) for i in xrange(max(1, payload_size // 4))]
+
+    if layout == 'cache':
+        header = root.add_group('CACH', group_type)
+        header.add_chunk('VRSN').string = '0.1'
+        header.add_chunk('STIM').ints = [250]
+        header.add_chunk('ETIM').ints = [250]
+        channels = root.add_group('MYCH', group_type)
+        for i in xrange(max(1, chunks // 3)):
+            channels.add_chunk('CHNM').string = 'channel%d' % i
+            channels.add_chunk('SIZE').ints = [len(floats)]
+            channels.add_chunk('FBCA').floats = floats
+        return root
+
+    if layout == 'nested':
+        data = binary.Chunk('FBCA')
+        data.floats = floats
+        data = data.data
+        groups = [root.add_group('NEST', group_type)]
+        for level in xrange(1, max(1, depth)):
+            groups.append(groups[-1].add_group('NEST', group_type))
+        for i in xrange(chunks):
+            groups[i % len(groups)].add_chunk('FBCA', data)
+        return root
+
+    raise ValueError('unknown layout %r' % layout)
+
+
+def _count_chunks(node):
+    return sum(_count_chunks(c) if isinstance(c, binary.Node) else 1 for c in node.children)
+
+
+def _parse(path, **kwargs):
+    with open(path, 'rb') as fh:
+        parser = binary.Parser(fh, **kwargs)
+        parser.parse_all()
+        if kwargs.get('memory_map'):
+            parser.close()
+
+
+def _iterparse(path):
+    with open(path, 'rb') as fh:
+        parser = binary.Parser(fh, lazy=True)
+        for event, group in parser.iterparse(events=('end', )):
+            group.clear()
+
+
+def _decode(path):
+    with open(path, 'rb') as fh:
+        parser = binary.Parser(fh, lazy=True, index=True)
+        parser.parse_all()
+        for chunk in parser.find('FBCA'):
+            chunk.floats
+            chunk.release()
+
+
+def _dump(path):
+    with open(path, 'rb') as fh:
+        parser = binary.Parser(fh)
+        parser.parse_all()
+    with open(os.devnull, 'wb') as fh:
+        parser.dump(fh)
+
+
+def _scan_toc(path):
+    with open(path, 'rb') as fh:
+        binary.TableOfContents.scan(fh)
+
+
+#: Map of benchmark names to functions which take the path to a file.
+benchmarks = {
+    'parse': _parse,
+    'parse_lazy': lambda path: _parse(path, lazy=True),
+    'parse_mmap': lambda path: _parse(path, memory_map=True),
+    'parse_index': lambda path: _parse(path, index=True),
+    'iterparse': _iterparse,
+    'decode': _decode,
+    'dump': _dump,
+    'toc': _scan_toc,
+}
+
+
+def _peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, but OS X reports bytes.
+    return rss * 1024 if sys.platform != 'darwin' else rss
+
+
+def _run_one(name, path, repeat):
+    func = benchmarks[name]
+    base_rss = _peak_rss()
+    times = []
+    for i in xrange(repeat):
+        start = time.time()
+        func(path)
+        times.append(time.time() - start)
+    return min(times), base_rss, _peak_rss()
+
+
+def _spawn_one(name, path, repeat):
+    """Run one benchmark in a fresh interpreter; see :func:`_run_one`.
+
+    A fork would start with (and so report) the memory of this process.
+
+    """
+    env = dict(os.environ)
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_root, env.get('PYTHONPATH')]))
+    proc = subprocess.Popen([
+        sys.executable, '-m', 'mayatools.benchmark',
+        '--run-one', name, '--repeat', str(repeat), path,
+    ], stdout=subprocess.PIPE, env=env)
+    out = proc.communicate()[0]
+    if proc.returncode:
+        raise RuntimeError('benchmark %r failed with code %d' % (name, proc.returncode))
+    return json.loads(out)
+
+
+def _generate_file(path, params, queue):
+    root = generate(**params)
+    with open(path, 'wb') as fh:
+        root.dump(fh)
+    queue.put(_count_chunks(root))
+
+
+def run(names=None, repeat=3, **params):
+    """Run benchmarks over a generated file, returning a JSON-able dict.
+
+    The file is generated in a child process, and each benchmark runs in its
+    own interpreter, reporting the best time of ``repeat`` runs, and the peak
+    memory of that interpreter before (``base_rss``, i.e. after importing
+    :mod:`.binary`) and after (``peak_rss``) running it.
+
+    :param names: The :data:`benchmarks` to run; defaults to all of them.
+    :param int repeat: How many times to run each benchmark.
+    :param params: Passed to :func:`generate`.
+
+    """
+
+    names = sorted(names or benchmarks)
+
+    tmp_dir = tempfile.mkdtemp(prefix='mayatools-benchmark.')
+    try:
+
+        # Generate in a child, so the graph is never in our memory.
+        path = os.path.join(tmp_dir, 'benchmark.mc')
+        queue = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=_generate_file, args=(path, params, queue))
+        proc.start()
+        chunk_count = queue.get()
+        proc.join()
+        size = os.path.getsize(path)
+
+        results = []
+        for name in names:
+            seconds, base_rss, peak_rss = _spawn_one(name, path, repeat)
+            results.append({
+                'name': name,
+                'seconds': seconds,
+                'mb_per_s': size / seconds / 1e6 if seconds else None,
+                'chunks_per_s': chunk_count / seconds if seconds else None,
+                'base_rss': base_rss,
+                'peak_rss': peak_rss,
+            })
+
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    return {
+        'time': datetime.datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': params,
+        'file_size': size,
+        'chunk_count': chunk_count,
+        'results': results,
+    }
+
+
+def format_results(run, baseline=None):
+    """Format the results of :func:`run` as a table, optionally with speedups
+    relative to a ``baseline`` run."""
+    baseline = dict((r['name'], r) for r in (baseline or {}).get('results', ()))
+    lines = ['%-12s %10s %10s %14s %10s%s' % ('name', 'seconds', 'MB/s', 'chunks/s', 'peak +MB', ' speedup' if baseline else '')]
+    for res in run['results']:
+        line = '%-12s %10.4f %10.1f %14.0f %10s' % (
+            res['name'],
+            res['seconds'],
+            res['mb_per_s'] or 0,
+            res['chunks_per_s'] or 0,
+            '%.1f' % ((res['peak_rss'] - res.get('base_rss', 0)) / 1e6) if res['peak_rss'] else '-',
+        )
+        old = baseline.get(res['name'])
+        if old and res['seconds']:
+            line += ' %7.2fx' % (old['seconds'] / res['seconds'])
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main():
+
+    from optparse import OptionParser
+
+    opt_parser = OptionParser(usage='%prog [options] [benchmark ...]')
+    opt_parser.add_option('-l', '--layout', default='cache', help='"cache" or "nested"')
+    opt_parser.add_option('-c', '--chunks', type='int', default=10000)
+    opt_parser.add_option('-d', '--depth', type='int', default=1)
+    opt_parser.add_option('-p', '--payload-size', type='int', default=1024)
+    opt_parser.add_option('-g', '--group-type', default='FOR4')
+    opt_parser.add_option('-r', '--repeat', type='int', default=3)
+    opt_parser.add_option('-o', '--output', help='save results to this JSON file')
+    opt_parser.add_option('--compare', help='compare against results in this JSON file')
+    opt_parser.add_option('--run-one', help='run one benchmark on an existing file and print JSON (used internally)')
+    opts, args = opt_parser.parse_args()
+
+    if opts.run_one:
+        if len(args) != 1:
+            opt_parser.error('--run-one takes one file')
+        print json.dumps(_run_one(opts.run_one, args[0], opts.repeat))
+        return
+
+    for name in args:
+        if name not in benchmarks:
+            opt_parser.error('unknown benchmark %r; choose from %s' % (name, ', '.join(sorted(benchmarks))))
+
+    res = run(args,
+        repeat=opts.repeat,
+        layout=opts.layout,
+        chunks=opts.chunks,
+        depth=opts.depth,
+        payload_size=opts.payload_size,
+        group_type=opts.group_type,
+    )
+
+    baseline = None
+    if opts.compare:
+        with open(opts.compare) as fh:
+            baseline = json.load(fh)
+
+    print '%d chunks in %.1f MB' % (res['chunk_count'], res['file_size'] / 1e6)
+    print format_results(res, baseline)
+
+    if opts.output:
+        with open(opts.output, 'w') as fh:
+            json.dump(res, fh, indent=4, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
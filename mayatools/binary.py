@@ -6,15 +6,62 @@ inspired :ref:`binary file format <binary_anatomy>`.
 """
 
 import array
+import binascii
+import bz2
+import contextlib
+import errno
 import functools
+import gzip
+import hashlib
 import itertools
+import mmap
+import multiprocessing
+import os
 import struct
 import string
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
 
 
 _is_printable = set(string.printable).difference(string.whitespace).__contains__
 
 
+# Map struct format characters to array typecodes of the same (standard) size,
+# and to the equivalent big-endian NumPy dtypes.
+_array_typecodes = {
+    'f': 'f',
+    'd': 'd',
+    'L': 'I' if array.array('I').itemsize == 4 else 'L',
+}
+_numpy_dtypes = {
+    'f': '>f4',
+    'd': '>f8',
+    'L': '>u4',
+}
+
+# Arrays are packed in native order, and everything on disk is big-endian.
+_needs_byteswap = sys.byteorder != 'big'
+
+
+def _bytes(data):
+    """Get packed data as a ``str``, copying it out of a buffer if required."""
+    # memoryview (which doesn't exist before Python 2.7) must be copied out.
+    tobytes = getattr(data, 'tobytes', None)
+    return tobytes() if tobytes is not None else str(data)
+
+
 class Encoder(object):
 
     """The base class for encoding/decoding packed data to/from native types."""
@@ -34,6 +81,10 @@ class Encoder(object):
         """Create string representation of a chunk returned from :meth:`split`."""
         return ''.join(c if _is_printable(c) else '.' for c in chunk)
 
+    def decode(self, encoded):
+        """Decode the packed data into a native type; raw data by default."""
+        return encoded
+
 
 class StructEncoder(Encoder):
 
@@ -51,6 +102,8 @@ class StructEncoder(Encoder):
             raise ValueError('encoded length %d is not multiple of %d; %d remains' % (len(encoded), self.size, rem))
         return struct.unpack('>%d%s' % (count, self.format_char), encoded)
 
+    decode = unpack
+
     def repr_chunk(self, encoded):
         return ' '.join(repr(x) for x in self.unpack(encoded))
 
@@ -60,6 +113,9 @@ class StringEncoder(Encoder):
     def split(self, encoded, size_hint):
         return encoded.rstrip('\0').split('\0')
 
+    def decode(self, encoded):
+        return encoded.rstrip('\0')
+
     def repr_chunk(self, chunk):
         return repr(chunk)
 
@@ -162,9 +218,15 @@ def hexdump(*args, **kwargs):
 
 def _hexdump(raw, initial_offset=0, chunk=4, line=16, indent='', tag=None):
 
+    encoder = get_encoder(tag)
+    if type(encoder) is Encoder:
+        for x in _hexdump_raw(raw, initial_offset, chunk, line, indent):
+            yield x
+        return
+
+    raw = _bytes(raw)
     chunk2 = 2 * chunk
     line2 = 2 * line
-    encoder = get_encoder(tag)
     offset = initial_offset
 
     for encoded_chunk in encoder.split(raw, line):
@@ -185,6 +247,44 @@ def _hexdump(raw, initial_offset=0, chunk=4, line=16, indent='', tag=None):
         yield '\n'
 
 
+# For replacing unprintable characters with dots in bulk.
+_printable_table = ''.join(c if _is_printable(c) else '.' for c in map(chr, xrange(256)))
+
+
+def _hexdump_raw(raw, initial_offset, chunk, line, indent, block_lines=4096):
+    """Equivalent to :func:`_hexdump` for raw data, but formats in bulk.
+
+    The data is hex-encoded and made printable a block at a time, so it may be
+    anything which can be sliced into strings (e.g. an mmap), and only one
+    block is held in memory at once.
+
+    """
+
+    chunk2 = 2 * chunk
+    line2 = 2 * line
+    block_size = line * block_lines
+    splits = range(0, line2, chunk2)
+
+    for block_start in xrange(0, len(raw), block_size):
+
+        block = _bytes(raw[block_start:block_start + block_size])
+        encoded = binascii.hexlify(block)
+        printable = block.translate(_printable_table)
+
+        out = []
+        for i in xrange(0, len(block), line):
+            hex_line = encoded[2 * i:2 * i + line2]
+            if len(hex_line) < line2:
+                hex_line = hex_line.ljust(line2)
+            out.append('%s%04x: %s %s\n' % (
+                indent,
+                initial_offset + block_start + i,
+                ' '.join([hex_line[j:j + chunk2] for j in splits]),
+                printable[i:i + line],
+            ))
+        yield ''.join(out)
+
+
 _group_tags = set()
 _tag_alignments = {}
 
@@ -195,6 +295,10 @@ for base in ('FORM', 'CAT ', 'LIST', 'PROP'):
         _tag_alignments[tag] = alignment
 
 
+_header_struct = struct.Struct('>4sL')
+_uint_struct = struct.Struct('>L')
+
+
 def _get_tag_alignment(tag):
     return _tag_alignments.get(tag, 2)
 
@@ -210,15 +314,42 @@ class Node(object):
 
     """Base class for group nodes in, and the root node of a Maya file graph."""
 
+    __slots__ = ('children', 'parent', '_index')
+
     def __init__(self):
 
         #: The children of this node.
         self.children = []
 
+        # Map of tags to all descendants with that tag (in the same order
+        # that :meth:`find` would return them), or None if not indexed.
+        self._index = None
+
     def add_child(self, child):
+        self._attach(child)
+        self._invalidate_index()
+        return child
+
+    def _invalidate_index(self):
+        # Modifying our children invalidates our index, and those of our
+        # ancestors.
+        node = self
+        while node is not None:
+            node._index = None
+            node = getattr(node, 'parent', None)
+
+    def _attach(self, child):
         self.children.append(child)
         child.parent = self
-        return child
+
+    def clear(self):
+        """Remove all children of this node, so they may be freed.
+
+        This is intended for use with :meth:`Parser.iterparse`.
+
+        """
+        self.children = []
+        self._invalidate_index()
 
     def add_group(self, *args, **kwargs):
         return self.add_child(Group(*args, **kwargs))
@@ -226,8 +357,29 @@ class Node(object):
     def add_chunk(self, *args, **kwargs):
         return self.add_child(Chunk(*args, **kwargs))
 
+    def build_index(self):
+        """Index all descendants by tag, so that :meth:`find` is a lookup.
+
+        The index is discarded when the graph is modified via
+        :meth:`add_child`. See the ``index`` argument of :class:`Parser` to
+        build it while parsing.
+
+        """
+        self._index = index = {}
+        for child in self.children:
+            index.setdefault(child.tag, []).append(child)
+            if isinstance(child, Node):
+                child.build_index()
+                for tag, nodes in child._index.iteritems():
+                    index.setdefault(tag, []).extend(nodes)
+
     def find(self, tag):
         """Iterate across all descendants of this node with a given tag."""
+        if self._index is not None:
+            return iter(self._index.get(tag, ()))
+        return self._iter_find(tag)
+
+    def _iter_find(self, tag):
         for child in self.children:
             if child.tag == tag:
                 yield child
@@ -243,15 +395,42 @@ class Node(object):
         :raises KeyError: if we can't find a tag and no default is given.
 
         """
+        if self._index is not None:
+            nodes = self._index.get(tag)
+            if nodes:
+                return nodes[0]
         for child in self.find(tag):
             return child
         if args:
             return args[0]
         raise KeyError(tag)
 
+    @property
+    def nbytes(self):
+        """The size of the packed version of this node, without packing it."""
+        return sum(child.nbytes for child in self.children)
+
+    def digest(self):
+        """Get a hex digest of the tags, types, and data of all descendants.
+
+        Graphs with the same digest have the same content, regardless of
+        where it came from.
+
+        """
+        hasher = hashlib.sha1()
+        self._update_digest(hasher)
+        return hasher.hexdigest()
+
+    def _update_digest(self, hasher):
+        for child in self.children:
+            child._update_digest(hasher)
+
     def dumps_iter(self):
         """Iterate chunks of the packed version of this node and its children.
 
+        The chunks are streamed directly from the nodes, so only the current
+        path through the graph is held in memory at once.
+
         To write to a file::
 
             with open(path, 'wb') as fh:
@@ -263,11 +442,17 @@ class Node(object):
             for x in child.dumps_iter():
                 yield x
 
+    def dump(self, file):
+        """Write the packed version of this node and its children to a file."""
+        for x in self.dumps_iter():
+            file.write(x)
+
 
 class Group(Node):
 
     """A group node in a Maya file graph."""
 
+    __slots__ = ('type', 'size', 'start', 'tag', 'alignment', 'end')
 
     def __init__(self, tag, type_='FOR4', size=0, start=0):
         super(Group, self).__init__()
@@ -290,69 +475,71 @@ class Group(Node):
         for child in self.children:
             child.pprint(_indent=_indent + 1)
 
+    @property
+    def nbytes(self):
+        # Type, size, and tag, followed by the children.
+        return 12 + super(Group, self).nbytes
+
+    def _update_digest(self, hasher):
+        hasher.update(self.type)
+        hasher.update(self.tag)
+        hasher.update(_uint_struct.pack(len(self.children)))
+        super(Group, self)._update_digest(hasher)
+
     def dumps_iter(self):
-        output = []
-        for child in self.children:
-            output.extend(child.dumps_iter())
         yield self.type
-        yield struct.pack(">L", sum(len(x) for x in output) + 4)
+        yield _uint_struct.pack(self.nbytes - 8)
         yield self.tag
-        for x in output:
-            yield x
+        for child in self.children:
+            for x in child.dumps_iter():
+                yield x
 
 
-class Chunk(object):
+class _Decodable(object):
 
-    def __init__(self, tag, data='', offset=None, **kwargs):
-        self.parent = None
+    """Interpretations of the :attr:`data` and :attr:`size` of a chunk."""
 
-        #: The data type.
-        self.tag = tag
+    __slots__ = ()
 
-        #: Raw binary data.
-        self.data = data
+    def _unpack(self, format_char):
+        unpacked = array.array(_array_typecodes[format_char])
+        if self.size % unpacked.itemsize:
+           raise ValueError('%s is not multiple of %d for %r format' % (self.size, unpacked.itemsize, format_char))
+        unpacked.fromstring(_bytes(self.data))
+        if _needs_byteswap:
+            unpacked.byteswap()
+        return unpacked
 
-        self.offset = offset
-        for k, v in kwargs.iteritems():
-            setattr(self, k, v)
+    def _pack(self, format_char, values):
+        if np is not None and isinstance(values, np.ndarray):
+            self.data = values.astype(_numpy_dtypes[format_char]).tobytes()
+            return
+        packed = array.array(_array_typecodes[format_char], values)
+        if _needs_byteswap:
+            packed.byteswap()
+        self.data = packed.tostring()
 
-    def pprint(self, _indent):
-        """Print a structured representation of the node to stdout."""
-        encoding = tag_encoding.get(self.tag)
-        if encoding:
-            header = '%d bytes as %s(s)' % (len(self.data), encoding)
-        else:
-            header = '%d raw bytes' % len(self.data)
-        print _indent * '    ' + ('%s; %s' % (self.tag, header))
-        print hexdump(self.data, self.offset, tag=self.tag, indent=(_indent + 1) * '    ').rstrip()
+    def as_array(self, dtype):
+        """Binary data as a read-only NumPy array, without copying it.
 
-    def __repr__(self):
-        return '<%s %s; %d bytes>' % (self.__class__.__name__, self.tag, len(self.data))
+        :param dtype: The NumPy dtype to interpret the data as; remember that
+            the data is big-endian, e.g. ``'>f4'`` or ``'>u4'``.
+        :raises ImportError: if NumPy is not available.
 
-    def dumps_iter(self):
-        yield self.tag
-        yield struct.pack(">L", len(self.data))
-        yield self.data
-        padding = _get_padding(len(self.data), self.parent.alignment)
-        if padding:
-            yield '\0' * padding
+        ::
 
-    def _unpack(self, format_char):
-        element_size = struct.calcsize('>' + format_char)
-        if len(self.data) % element_size:
-           raise ValueError('%s is not multiple of %d for %r format' % (len(self.data), element_size, format_char))
-        format_string = '>%d%s' % (len(self.data) / element_size, format_char)
-        unpacked = struct.unpack(format_string, self.data)
-        return array.array(format_char, unpacked)
+            >>> chunk.as_array('>f4').reshape(-1, 3)
 
-    def _pack(self, format_char, values):
-        self.data = struct.pack('>%d%s' % (len(values), format_char), *values)
+        """
+        if np is None:
+            raise ImportError('NumPy is required for Chunk.as_array')
+        return np.frombuffer(self.data, dtype=dtype)
 
     @property
     def ints(self):
         """Binary data interpreted as array of unsigned integers.
 
-        This is settable to an iterable of integers."""
+        This is settable to an iterable of integers, or a NumPy array."""
         return self._unpack('L')
 
     @ints.setter
@@ -363,7 +550,7 @@ class Chunk(object):
     def floats(self):
         """Binary data interpreted as array of floats.
 
-        This is settable to an iterable of floats."""
+        This is settable to an iterable of floats, or a NumPy array."""
         return self._unpack('f')
 
     @floats.setter
@@ -375,88 +562,1004 @@ class Chunk(object):
         """Binary data interpreted as a string.
 
         This is settable with a string."""
-        return self.data.rstrip('\0')
+        return _bytes(self.data).rstrip('\0')
 
     @string.setter
     def string(self, v):
         self.data = str(v).rstrip('\0') + '\0'
 
 
+class Chunk(_Decodable):
+
+    """A data node in a Maya file graph."""
+
+    __slots__ = ('parent', 'tag', 'offset', '_data', '_size', '_source')
+
+    def __init__(self, tag, data='', offset=None, size=None, source=None):
+        self.parent = None
+
+        #: The data type.
+        self.tag = tag
+
+        self._data = data
+        self._size = len(data) if size is None else size
+        self._source = source
+
+        self.offset = offset
+
+    @property
+    def data(self):
+        """Raw binary data.
+
+        This may be a zero-copy ``buffer`` into the file if it was parsed via a
+        memory map. If it was parsed lazily, it is read from the file upon
+        first access.
+
+        """
+        if self._data is None and self._source is not None:
+            self._data = self._source._read_at(self.offset, self._size)
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        # Once assigned, the data can no longer be reread from the file.
+        self._data = value
+        self._source = None
+
+    @property
+    def size(self):
+        """The size of the packed data, without loading it."""
+        if self._data is None:
+            return self._size
+        return len(self._data)
+
+    def release(self):
+        """Drop the data of a lazily parsed chunk; it will be reread on access.
+
+        This does nothing for chunks which are not backed by a file.
+
+        """
+        if self._source is not None:
+            self._data = None
+
+    def pprint(self, _indent):
+        """Print a structured representation of the node to stdout."""
+        encoding = tag_encoding.get(self.tag)
+        if encoding:
+            header = '%d bytes as %s(s)' % (self.size, encoding)
+        else:
+            header = '%d raw bytes' % self.size
+        print _indent * '    ' + ('%s; %s' % (self.tag, header))
+        print hexdump(self.data, self.offset, tag=self.tag, indent=(_indent + 1) * '    ').rstrip()
+
+    def __repr__(self):
+        return '<%s %s; %d bytes>' % (self.__class__.__name__, self.tag, self.size)
+
+    def digest(self):
+        """Get a hex digest of the data of this chunk."""
+        return hashlib.sha1(self.data).hexdigest()
+
+    def _update_digest(self, hasher):
+        hasher.update(self.tag)
+        hasher.update(_uint_struct.pack(self.size))
+        hasher.update(self.data)
+
+    @property
+    def nbytes(self):
+        """The size of the packed version of this node, including padding."""
+        return 8 + self.size + _get_padding(self.size, self.parent.alignment)
+
+    def dumps_iter(self):
+        yield self.tag
+        yield _uint_struct.pack(len(self.data))
+        yield self.data
+        padding = _get_padding(len(self.data), self.parent.alignment)
+        if padding:
+            yield '\0' * padding
+
+# Map file extensions to the classes which transparently (de)compress them.
+_compressors = {
+    '.gz': gzip.GzipFile,
+    '.bz2': bz2.BZ2File,
+}
+if lzma is not None:
+    _compressors['.xz'] = lzma.LZMAFile
+_compressed_types = tuple(_compressors.values())
+
+
+def open_file(path, mode='rb'):
+    """Open a file, transparently (de)compressing it based on its extension.
+
+    Files ending in ``.gz``, ``.bz2`` and (if the ``lzma`` module is
+    available) ``.xz`` are compressed; everything else is a normal file. Both
+    :class:`Parser` and :meth:`Node.dump` work with the results::
+
+        with contextlib.closing(open_file('fluidShape1Frame1.mc.gz', 'wb')) as fh:
+            frame.dump(fh)
+
+    (Compressed files are only context managers themselves in Python 2.7+.)
+
+    """
+    ext = os.path.splitext(path)[1]
+    if ext == '.xz' and lzma is None:
+        raise ValueError('cannot open %r without the lzma module' % path)
+    cls = _compressors.get(ext)
+    if cls is None:
+        return open(path, mode)
+    return cls(path, mode)
+
+
+def _is_seekable(file):
+    # Compressed files can seek, but only by decompressing from the start.
+    if _compressed_types and isinstance(file, _compressed_types):
+        return False
+    try:
+        file.seek(0, os.SEEK_CUR)
+    except (AttributeError, IOError, OSError):
+        return False
+    return True
+
+
 class Parser(Node):
 
     """Maya binary file parser.
 
-    :param file: The file-like object to parse from; must support ``read(size)``
-        and ``tell()``.
+    :param file: The file-like object to parse from; must support ``read(size)``.
+        Files which cannot seek (e.g. pipes, or compressed files from
+        :func:`open_file`) are read strictly forwards, reading through any
+        data which is skipped.
+    :param bool memory_map: Map the file into memory instead of reading it;
+        ``file`` must then be a real file with a ``fileno()``. The
+        :attr:`Chunk.data` of each chunk will be a zero-copy ``buffer`` into
+        the mapping, so nothing is copied until it is decoded. These buffers
+        are only valid until the parser is closed.
+    :param bool lazy: Only record the offset and size of each chunk, and skip
+        over its data; :attr:`Chunk.data` is read on first access via this
+        parser's file and may be dropped again via :meth:`Chunk.release`.
+        This is ignored for files which cannot seek.
+    :param bool index: Index every group by the tags of its descendants while
+        parsing, so that :meth:`~Node.find` and :meth:`~Node.find_one` are
+        dictionary lookups.
 
     """
 
-    def __init__(self, file):
+    def __init__(self, file, memory_map=False, lazy=False, index=False):
         super(Parser, self).__init__()
 
         self._file = file
+        self._seekable = _is_seekable(file)
+        self._lazy = lazy and self._seekable
         self._group_stack = []
+        self._ended_groups = None
         self.children = []
+        self._index = {} if index else None
+        self._indexing = index
+
+        # Everything is read through a buffer, which is either the memory map
+        # of the whole file, or a block of the file starting at _buf_start.
+        # The file is always positioned at the end of the block.
+        self._map = None
+        self._buf = ''
+        self._buf_start = file.tell() if self._seekable else 0
+        self._buf_pos = 0
+        if memory_map:
+            if not self._seekable:
+                raise ValueError('cannot memory map a file which cannot seek')
+            if os.fstat(file.fileno()).st_size:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # Empty files cannot be mapped, but an empty string behaves
+                # identically for our purposes.
+                self._map = ''
+            self._buf = self._map
+            self._buf_start = 0
+            self._buf_pos = file.tell()
+
+    #: How many bytes to read from the file at once when decoding headers.
+    block_size = 64 * 1024
 
     def close(self):
+        if self._map:
+            self._map.close()
         self._file.close()
 
+    def _tell(self):
+        return self._buf_start + self._buf_pos
+
+    def tell(self):
+        """The offset in the file that has been parsed up to."""
+        return self._tell()
+
+    def _fill(self, size):
+        """Buffer at least ``size`` bytes, unless the file ends first."""
+        available = len(self._buf) - self._buf_pos
+        if available >= size or self._map is not None:
+            return
+        self._buf = self._buf[self._buf_pos:] + self._file.read(max(size - available, self.block_size))
+        self._buf_start += self._buf_pos
+        self._buf_pos = 0
+
+    def _read_header(self):
+        """Read a tag and size, or return ``(None, None)`` at the end of the file."""
+        self._fill(8)
+        if self._buf_pos >= len(self._buf):
+            return None, None
+        tag, size = _header_struct.unpack_from(self._buf, self._buf_pos)
+        self._buf_pos += 8
+        return tag, size
+
+    def _read(self, size):
+        self._fill(size)
+        data = self._buf[self._buf_pos:self._buf_pos + size]
+        self._buf_pos += len(data)
+        return data
+
+    def _read_view(self, size):
+        """Like :meth:`_read`, but returns a zero-copy buffer if memory mapped."""
+
+        if self._map is not None:
+            start = self._buf_pos
+            self._buf_pos = min(start + size, len(self._map))
+            # Python 2's mmap does not support memoryview, but old-style
+            # buffers are just as good for slicing without a copy.
+            return buffer(self._map, start, self._buf_pos - start)
+
+        # Large reads bypass the buffer entirely.
+        available = len(self._buf) - self._buf_pos
+        if size > available and size >= self.block_size:
+            data = self._buf[self._buf_pos:] + self._file.read(size - available)
+            self._buf_start += self._buf_pos + len(data)
+            self._buf = ''
+            self._buf_pos = 0
+            return data
+
+        return self._read(size)
+
+    def _skip(self, size):
+        if self._map is not None or self._buf_pos + size <= len(self._buf):
+            self._buf_pos += size
+        elif not self._seekable:
+            # Read through anything we can't seek past.
+            remaining = size - (len(self._buf) - self._buf_pos)
+            self._buf_start += len(self._buf)
+            self._buf = ''
+            self._buf_pos = 0
+            while remaining > 0:
+                data = self._file.read(min(remaining, self.block_size))
+                if not data:
+                    break
+                remaining -= len(data)
+                self._buf_start += len(data)
+        else:
+            self._buf_start += self._buf_pos + size
+            self._buf = ''
+            self._buf_pos = 0
+            self._file.seek(self._buf_start)
+
+    def _read_at(self, offset, size):
+        """Read from an absolute offset without disturbing the parse."""
+        if self._map is not None:
+            return buffer(self._map, offset, size)
+        end = offset + size
+        if offset >= self._buf_start and end <= self._buf_start + len(self._buf):
+            return self._buf[offset - self._buf_start:end - self._buf_start]
+        try:
+            self._file.seek(offset)
+            return self._file.read(size)
+        finally:
+            self._file.seek(self._buf_start + len(self._buf))
+
+    @classmethod
+    def from_toc(cls, file, toc=None, **kwargs):
+        """Build the graph of a file from its :class:`TableOfContents`.
+
+        The file is not scanned at all; every chunk is lazy, and is only read
+        on first access to its :attr:`~Chunk.data`.
+
+        :param file: The file to read data from; see :class:`Parser`.
+        :param toc: The :class:`TableOfContents` to use, or ``None`` to
+            find one via :func:`get_toc` and ``file.name``.
+        :param kwargs: Passed to :class:`Parser`.
+
+        """
+        if toc is None:
+            toc = get_toc(file.name)
+        self = cls(file, **kwargs)
+        toc._populate(self)
+
+        # There is nothing left to parse.
+        if self._map is not None:
+            self._buf_pos = len(self._map)
+        else:
+            self._file.seek(0, os.SEEK_END)
+            self._buf_start = self._file.tell()
+
+        return self
+
     def pprint(self, _indent=-1):
         """Print a structured representation of the file to stdout."""
         for child in self.children:
             child.pprint(_indent=_indent + 1)
 
-    def parse_next(self):
+    def parse_next(self, include_tags=None, skip_tags=None, max_depth=None):
         """Parse to the next :class:`Group` or :class:`Chunk`, returning it.
 
         This is useful when you want to head the headers of a file without
         loading its entire contents into memory.
 
+        Nodes may be filtered out, in which case the file seeks past them
+        without reading their data, and they are not added to the graph:
+
+        :param include_tags: Only keep chunks with one of these tags.
+        :param skip_tags: Skip groups and chunks with one of these tags; the
+            entire contents of skipped groups are skipped as well.
+        :param int max_depth: Keep at most this many levels of groups, and
+            skip (with their contents) groups nested within ``max_depth`` or
+            more other groups; e.g. ``1`` only keeps top-level groups and
+            their direct chunks.
+        :returns: The next node which was not filtered, or ``None`` at the
+            end of the file.
+
         """
-        # Clean the group stack.
-        while self._group_stack and self._group_stack[-1].end <= self._file.tell():
-            self._group_stack.pop(-1)
+        while True:
+
+            # Clean the group stack.
+            while self._group_stack and self._group_stack[-1].end <= self._tell():
+                group = self._group_stack.pop(-1)
+                if self._ended_groups is not None:
+                    self._ended_groups.append(group)
+
+            # Read a tag and size from the file.
+            tag, size = self._read_header()
+            if tag is None:
+                return
+
+            if tag in _group_tags:
+
+                offset = self._tell()
+                group_tag = self._read(4)
+
+                if (
+                    (skip_tags and group_tag in skip_tags) or
+                    (max_depth is not None and len(self._group_stack) >= max_depth)
+                ):
+                    self._skip(size - 4 + _get_padding(size, _get_tag_alignment(tag)))
+                    continue
+
+                group = Group(group_tag, tag, size, offset)
+
+                # Add it as a child of the current group.
+                group_head = self._group_stack[-1] if self._group_stack else self
+                group_head._attach(group)
+                self._index_node(group)
+
+                self._group_stack.append(group)
+                if self._index is not None:
+                    group._index = {}
 
-        # Read a tag and size from the file.
-        tag = self._file.read(4)
-        if not tag:
+                return group
+
+            else:
+
+                assert self._group_stack, 'Data chunk outside of group.'
+                padding = _get_padding(size, self._group_stack[-1].alignment)
+
+                if (
+                    (skip_tags and tag in skip_tags) or
+                    (include_tags is not None and tag not in include_tags)
+                ):
+                    self._skip(size + padding)
+                    continue
+
+                offset = self._tell()
+                if self._lazy:
+                    self._skip(size)
+                    chunk = Chunk(tag, None, offset, size=size, source=self)
+                else:
+                    data = self._read_view(size)
+                    chunk = Chunk(tag, data, offset)
+
+                self._group_stack[-1]._attach(chunk)
+                self._index_node(chunk)
+
+                # Cleanup padding.
+                if padding:
+                    self._read(padding)
+
+                return chunk
+
+    def skip_group(self, group):
+        """Seek past the rest of an open group without parsing it, e.g. to
+        read only the first chunk of each group in a large file.
+
+        :param Group group: The group to skip to the end of.
+
+        """
+        remaining = group.end - self._tell()
+        if remaining > 0:
+            self._skip(remaining)
+
+    def _index_node(self, node):
+        if self._index is None:
+            if self._indexing:
+                # Modifying the graph (e.g. with clear()) stops indexing, so
+                # the groups still being parsed can't keep partial indexes.
+                self._indexing = False
+                for group in self._group_stack:
+                    group._index = None
             return
-        size = struct.unpack(">L", self._file.read(4))[0]
+        self._index.setdefault(node.tag, []).append(node)
+        for group in self._group_stack:
+            group._index.setdefault(node.tag, []).append(node)
+
+    def parse_all(self, **kwargs):
+        """Parse the entire (remaining) file.
 
-        if tag in _group_tags:
+        Accepts the same filtering arguments as :meth:`parse_next`::
 
-            offset = self._file.tell()
-            group_tag = self._file.read(4)
-            group = Group(group_tag, tag, size, offset)
+            >>> parser.parse_all(include_tags=('CHNM', 'SIZE'), skip_tags=('CACH', ))
 
-            # Add it as a child of the current group.
-            group_head = self._group_stack[-1] if self._group_stack else self
-            group_head.add_child(group)
+        """
+        while self.parse_next(**kwargs) is not None:
+            pass
 
-            self._group_stack.append(group)
+    def iterparse(self, events=('start', 'chunk', 'end'), **kwargs):
+        """Parse the (remaining) file, yielding ``(event, node)`` pairs.
 
-            return group
+        The events are ``"start"`` as a :class:`Group` is entered, ``"chunk"``
+        for each :class:`Chunk`, and ``"end"`` after the last child of a group.
+        Much like :func:`xml.etree.ElementTree.iterparse`, nodes are still
+        added to the graph, so to run in constant memory you must
+        :meth:`~Node.clear` them once you are done with them::
+
+            for event, node in parser.iterparse(events=('end', )):
+                if node.tag == 'MYCH':
+                    process(node)
+                    node.clear()
+
+        :param events: The events to report.
+        :param kwargs: Filters to pass to :meth:`parse_next`.
+
+        """
+        self._ended_groups = ended = []
+        try:
+            while True:
+                node = self.parse_next(**kwargs)
+                if node is None:
+                    # Anything left open has run off the end of the file.
+                    ended.extend(reversed(self._group_stack))
+                    self._group_stack = []
+                if 'end' in events:
+                    for group in ended:
+                        yield 'end', group
+                ended[:] = []
+                if node is None:
+                    return
+                event = 'start' if isinstance(node, Group) else 'chunk'
+                if event in events:
+                    yield event, node
+        finally:
+            self._ended_groups = None
+
+
+def dump_arrays(file, arrays):
+    """Write the contents of arrays to a file, big-endian; see :func:`load_arrays`."""
+    for values in arrays:
+        if _needs_byteswap:
+            values = array.array(values.typecode, values)
+            values.byteswap()
+        file.write(values.tostring())
+
+
+def load_arrays(file, arrays, counts):
+    """Extend arrays with items read from a file written by :func:`dump_arrays`.
+
+    :param file: The file to read from.
+    :param arrays: The :class:`array.array` objects to extend, in order.
+    :param counts: How many items to read into each array.
+    :raises ValueError: if the file is truncated.
 
+    """
+    for values, count in zip(arrays, counts):
+        encoded = file.read(count * values.itemsize)
+        if len(encoded) != count * values.itemsize:
+            raise ValueError('truncated %r array' % values.typecode)
+        loaded = array.array(values.typecode)
+        loaded.fromstring(encoded)
+        if _needs_byteswap:
+            loaded.byteswap()
+        values.extend(loaded)
+
+
+class TableOfContents(object):
+
+    """A compact listing of the tag, type, offset and size of every node in a
+    binary file, so that its structure may be rebuilt without scanning it.
+
+    Nodes are rows across parallel arrays, in the order they appear in the
+    file. Tags and group types are stored as indices into :attr:`tag_names`
+    (in which ``0`` is reserved for the "type" of chunks), and parents as the
+    row of the enclosing group (or ``-1`` at the top level). Offsets are those
+    of :attr:`Group.start` and :attr:`Chunk.offset`.
+
+    See :func:`get_toc` to cache them, and :meth:`Parser.from_toc` to use them.
+
+    """
+
+    _header_struct = struct.Struct('>4sHQdLL')
+    _magic = 'MTOC'
+    _version = 1
+
+    _columns = ('tags', 'types', 'offsets', 'sizes', 'parents')
+
+    def __init__(self):
+
+        self.tag_names = ['']
+        self._tag_ids = {'': 0}
+
+        self.tags = array.array('H')
+        self.types = array.array('H')
+        # Python 2's arrays have no portable 64-bit integer, but doubles are
+        # exact for any offset we will see.
+        self.offsets = array.array('d')
+        self.sizes = array.array('I')
+        self.parents = array.array('i')
+
+        #: The size and modification time of the file when it was scanned.
+        self.st_size = self.st_mtime = None
+
+        # See _link and root.
+        self._depths = self._first_children = self._next_siblings = None
+        self._file = None
+
+    def __len__(self):
+        return len(self.tags)
+
+    def _get_tag_id(self, tag):
+        try:
+            return self._tag_ids[tag]
+        except KeyError:
+            id_ = self._tag_ids[tag] = len(self.tag_names)
+            self.tag_names.append(tag)
+            return id_
+
+    def append(self, tag, type_, offset, size, parent=-1):
+        """Add a node, returning its row.
+
+        :param str type_: The group type, or ``None`` for chunks.
+
+        """
+        self._depths = None
+        self.tags.append(self._get_tag_id(tag))
+        self.types.append(self._get_tag_id(type_) if type_ else 0)
+        self.offsets.append(offset)
+        self.sizes.append(size)
+        self.parents.append(parent)
+        return len(self.tags) - 1
+
+    @classmethod
+    def scan(cls, file):
+        """Build a table of contents by scanning a file.
+
+        Chunk data is skipped, and nodes are released as soon as they are
+        recorded.
+
+        """
+        self = cls()
+        parser = Parser(file, lazy=True)
+        stack = []
+        for event, node in parser.iterparse():
+            if event == 'start':
+                stack.append(self.append(node.tag, node.type, node.start, node.size, stack[-1] if stack else -1))
+            elif event == 'chunk':
+                self.append(node.tag, None, node.offset, node.size, stack[-1])
+            else:
+                stack.pop()
+                node.clear()
+                if not stack:
+                    parser.clear()
+        return self
+
+    def _populate(self, parser):
+        names = self.tag_names
+        nodes = []
+        for tag_id, type_id, offset, size, parent in itertools.izip(*(getattr(self, name) for name in self._columns)):
+            if type_id:
+                node = Group(names[tag_id], names[type_id], size, int(offset))
+            else:
+                node = Chunk(names[tag_id], None, int(offset), size=size, source=parser)
+            (nodes[parent] if parent >= 0 else parser)._attach(node)
+            nodes.append(node)
+        if parser._index is not None:
+            parser.build_index()
+
+    def root(self, file):
+        """Get a :class:`TableNode` for the root of the graph.
+
+        Unlike :meth:`Parser.from_toc`, this does not construct the graph;
+        lightweight proxies are created on demand as it is walked, and all
+        data lives in the columns of the table.
+
+        :param file: The file to read chunk data from.
+
+        """
+        self._file = file
+        return TableNode(self, -1)
+
+    def _link(self):
+        """Build the depth, first child, and next sibling of every row.
+
+        The root is given row ``-1``, i.e. the last element of these arrays,
+        so that parents may be looked up directly.
+
+        """
+        if self._depths is not None:
+            return
+        count = len(self)
+        depths = array.array('i', [-1]) * (count + 1)
+        first_children = array.array('i', [-1]) * (count + 1)
+        next_siblings = array.array('i', [-1]) * (count + 1)
+        last_children = array.array('i', [-1]) * (count + 1)
+        for row, parent in enumerate(self.parents):
+            depths[row] = depths[parent] + 1
+            if last_children[parent] < 0:
+                first_children[parent] = row
+            else:
+                next_siblings[last_children[parent]] = row
+            last_children[parent] = row
+        self._depths = depths
+        self._first_children = first_children
+        self._next_siblings = next_siblings
+
+    def _read_at(self, offset, size):
+        self._file.seek(offset)
+        return self._file.read(size)
+
+    def dump(self, file):
+        """Write the table of contents to a file."""
+        names = '\0'.join(self.tag_names)
+        file.write(self._header_struct.pack(
+            self._magic, self._version,
+            self.st_size or 0, self.st_mtime or 0,
+            len(self), len(names),
+        ))
+        file.write(names)
+        dump_arrays(file, [getattr(self, name) for name in self._columns])
+
+    @classmethod
+    def load(cls, file):
+        """Read a table of contents from a file written by :meth:`dump`.
+
+        :raises ValueError: if the file is not a table of contents.
+
+        """
+        header = file.read(cls._header_struct.size)
+        if len(header) != cls._header_struct.size:
+            raise ValueError('truncated table of contents')
+        magic, version, st_size, st_mtime, count, names_size = cls._header_struct.unpack(header)
+        if magic != cls._magic or version != cls._version:
+            raise ValueError('not a version %d table of contents' % cls._version)
+
+        self = cls()
+        self.st_size = st_size
+        self.st_mtime = st_mtime
+        self.tag_names = file.read(names_size).split('\0')
+        self._tag_ids = dict((name, i) for i, name in enumerate(self.tag_names))
+        load_arrays(file, [getattr(self, name) for name in self._columns], [count] * len(self._columns))
+        return self
+
+
+class TableNode(_Decodable):
+
+    """A lightweight, read-only view of a row of a :class:`TableOfContents`.
+
+    These mirror the attributes of :class:`Group` and :class:`Chunk` (for
+    groups :attr:`type` is set, and for chunks it is ``None``), but are only
+    created as they are accessed; see :meth:`TableOfContents.root`.
+
+    """
+
+    __slots__ = ('_toc', '_row')
+
+    def __init__(self, toc, row):
+        self._toc = toc
+        self._row = row
+
+    def __repr__(self):
+        if self._row < 0:
+            return '<%s root>' % self.__class__.__name__
+        return '<%s %s %s; %d bytes>' % (self.__class__.__name__, self.tag, self.type or 'chunk', self.size)
+
+    def __eq__(self, other):
+        return isinstance(other, TableNode) and self._toc is other._toc and self._row == other._row
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self._toc), self._row))
+
+    @property
+    def tag(self):
+        if self._row >= 0:
+            return self._toc.tag_names[self._toc.tags[self._row]]
+
+    @property
+    def type(self):
+        if self._row >= 0:
+            return self._toc.tag_names[self._toc.types[self._row]] or None
+
+    @property
+    def size(self):
+        if self._row >= 0:
+            return self._toc.sizes[self._row]
+
+    @property
+    def offset(self):
+        if self._row >= 0:
+            return int(self._toc.offsets[self._row])
+
+    start = offset
+
+    @property
+    def data(self):
+        """Raw binary data, read from the file on every access."""
+        return self._toc._read_at(self.offset, self.size)
+
+    @property
+    def parent(self):
+        if self._row >= 0:
+            return TableNode(self._toc, self._toc.parents[self._row])
+
+    @property
+    def children(self):
+        toc = self._toc
+        toc._link()
+        children = []
+        row = toc._first_children[self._row]
+        while row >= 0:
+            children.append(TableNode(toc, row))
+            row = toc._next_siblings[row]
+        return children
+
+    def find(self, tag):
+        """Iterate across all descendants of this node with a given tag."""
+        toc = self._toc
+        tag_id = toc._tag_ids.get(tag)
+        if tag_id is None:
+            return
+        toc._link()
+        # Rows are in file order, so descendants directly follow their
+        # ancestor, until we return to its depth.
+        depths = toc._depths
+        depth = depths[self._row]
+        tags = toc.tags
+        for row in xrange(self._row + 1, len(toc)):
+            if depths[row] <= depth:
+                break
+            if tags[row] == tag_id:
+                yield TableNode(toc, row)
+
+    def find_one(self, tag, *args):
+        """Find the first descendant of this node with a given tag.
+
+        :raises KeyError: if we can't find a tag and no default is given.
+
+        """
+        for node in self.find(tag):
+            return node
+        if args:
+            return args[0]
+        raise KeyError(tag)
+
+
+def scan(path, tags=None):
+    """Extract and decode the chunks with the given tags from a file.
+
+    :param str path: The file to scan; it may be compressed (see :func:`open_file`).
+    :param tags: The tags of chunks to extract, or ``None`` for all.
+    :returns: A ``dict`` mapping tags to a list of values (as decoded by
+        :meth:`Encoder.decode`), one for each chunk in the file with that tag.
+
+    """
+    with contextlib.closing(open_file(path)) as fh:
+        parser = Parser(fh, memory_map=_is_seekable(fh))
+        try:
+            res = {}
+            for event, chunk in parser.iterparse(events=('chunk', ), include_tags=tags):
+                res.setdefault(chunk.tag, []).append(get_encoder(chunk.tag).decode(_bytes(chunk.data)))
+                chunk.parent.clear()
+            return res
+        finally:
+            parser.close()
+
+
+def _scan_star(args):
+    return scan(*args)
+
+
+def scan_many(paths, tags=None, workers=None):
+    """Run :func:`scan` on many files in parallel across a pool of processes.
+
+    ::
+
+        >>> scan_many(glob.glob('cache/*Frame*.mc'), tags=('STIM', 'ETIM', 'CHNM'))
+        [{'STIM': [(250, )], 'ETIM': [(250, )], 'CHNM': ['pSphereShape1']}, ...]
+
+    :param paths: The files to scan.
+    :param tags: The tags to extract; see :func:`scan`.
+    :param int workers: How many processes to use; defaults to the number of
+        CPUs, and ``1`` scans in this process.
+    :returns: A list of results from :func:`scan`, in the same order as the paths.
+
+    """
+    paths = list(paths)
+    tags = frozenset(tags) if tags is not None else None
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(paths))
+    if workers <= 1:
+        return [scan(path, tags) for path in paths]
+    pool = multiprocessing.Pool(workers)
+    try:
+        chunksize = max(1, len(paths) // (4 * workers))
+        return pool.map(_scan_star, [(path, tags) for path in paths], chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def patch(path, updates, toc=None):
+    """Overwrite the data of chunks within a file, without rewriting the file.
+
+    This only works when the new data is exactly the same size as the old,
+    e.g. to shift a frame of a cache in time::
+
+        >>> patch(path, {
+        ...     'STIM': lambda chunk: struct.pack('>L', chunk.ints[0] + 250),
+        ...     'ETIM': lambda chunk: struct.pack('>L', chunk.ints[0] + 250),
+        ... })
+
+    :param str path: The file to modify.
+    :param dict updates: Map of tags to the new packed data for every chunk
+        with that tag, or a function which takes the existing chunk and
+        returns its new packed data.
+    :param toc: A :class:`TableOfContents` of the file (see :func:`get_toc`)
+        to find the chunks with instead of scanning the file. If its recorded
+        size and modification time do not match the file it is ignored and
+        the file is scanned; otherwise they are updated to match the patched
+        file, and the table is written back to where :func:`get_toc` caches it.
+    :returns: The number of chunks that were modified.
+    :raises ValueError: if the new data is not the same size as the old, or
+        a chunk is not where the table says, in which case nothing is written.
+
+    """
+
+    with open(path, 'r+b') as fh:
+
+        stat = os.fstat(fh.fileno())
+        if toc is not None and (toc.st_size != stat.st_size or toc.st_mtime != stat.st_mtime):
+            toc = None
+
+        if toc is not None:
+            chunks = [c for tag in updates for c in toc.root(fh).find(tag)]
         else:
+            parser = Parser(fh, lazy=True)
+            parser.parse_all(include_tags=frozenset(updates))
+            chunks = [c for tag in updates for c in parser.find(tag)]
+
+        # Prepare all of the data before writing anything.
+        patches = []
+        for chunk in chunks:
+            data = updates[chunk.tag]
+            if callable(data):
+                data = data(chunk)
+            data = _bytes(data)
+            if len(data) != chunk.size:
+                raise ValueError('cannot patch %d bytes of %s @ %x with %d bytes' % (chunk.size, chunk.tag, chunk.offset, len(data)))
+            patches.append((chunk.offset, chunk.tag, data))
+
+        # Make sure that every chunk is still where we think it is.
+        if toc is not None:
+            for offset, tag, data in patches:
+                fh.seek(offset - 8)
+                if fh.read(4) != tag:
+                    raise ValueError('%s is not at %x; the table of contents is out of date' % (tag, offset))
+
+        for offset, tag, data in sorted(patches):
+            fh.seek(offset)
+            fh.write(data)
+
+    if toc is not None:
+        stat = os.stat(path)
+        toc.st_size = stat.st_size
+        toc.st_mtime = stat.st_mtime
+        sidecar_path = path + '.toc'
+        atomic_write(sidecar_path if os.path.exists(sidecar_path) else get_toc_cache_path(path), toc.dump)
+
+    return len(patches)
+
+
+def get_cache_path(namespace, path, ext):
+    """Get a path in the user's cache directory for data about the given file.
+
+    :param str namespace: The kind of data, used as a directory name.
+    :param str path: The file the data is about.
+    :param str ext: The extension for the cache file.
+
+    """
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    key = hashlib.sha1(os.path.abspath(path)).hexdigest()
+    return os.path.join(root, 'mayatools', namespace, key + ext)
+
 
-            offset = self._file.tell()
-            data = self._file.read(size)
-            chunk = Chunk(tag, data, offset)
+def atomic_write(path, write, mode='wb'):
+    """Write a file via a temporary file beside it, so that concurrent readers
+    never see it partially written; for caches, so failures are ignored.
 
-            assert self._group_stack, 'Data chunk outside of group.'
-            self._group_stack[-1].add_child(chunk)
+    :param str path: The file to write; its directory is created if required.
+    :param write: A function to call with the open temporary file.
+    :param str mode: The mode to open the file with.
+    :return bool: If the file was written.
 
-            # Cleanup padding.
-            padding = _get_padding(size, self._group_stack[-1].alignment)
-            if padding:
-                self._file.read(padding)
+    """
+    directory = os.path.dirname(path)
+    try:
+        if directory:
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, mode) as fh:
+            write(fh)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def get_toc_cache_path(path):
+    """Get the path in the user's cache directory for the TOC of the given file."""
+    return get_cache_path('binary-toc', path, '.toc')
+
+
+def get_toc(path, sidecar=False, cache=True):
+    """Get the :class:`TableOfContents` of a file, scanning it only if required.
+
+    Tables are cached, and are reused as long as the size and modification
+    time of the file have not changed. Failure to write the cache is ignored.
+
+    :param str path: The file to get the table of contents of.
+    :param bool sidecar: Cache the table beside the file (as ``path + ".toc"``)
+        instead of in the user's cache directory (see :func:`get_toc_cache_path`).
+    :param bool cache: Use and update the cache?
+
+    """
 
-            return chunk
+    stat = os.stat(path)
+    toc_path = path + '.toc' if sidecar else get_toc_cache_path(path)
 
-    def parse_all(self):
-        """Parse the entire (remaining) file."""
-        while self.parse_next() is not None:
+    if cache:
+        try:
+            with open(toc_path, 'rb') as fh:
+                toc = TableOfContents.load(fh)
+        except (IOError, ValueError):
             pass
+        else:
+            if toc.st_size == stat.st_size and toc.st_mtime == stat.st_mtime:
+                return toc
+
+    with open(path, 'rb') as fh:
+        toc = TableOfContents.scan(fh)
+    toc.st_size = stat.st_size
+    toc.st_mtime = stat.st_mtime
+
+    if cache:
+        atomic_write(toc_path, toc.dump)
+
+    return toc
 
 
 if __name__ == '__main__':
@@ -467,11 +1570,22 @@ if __name__ == '__main__':
     opt_parser.add_option('-t', '--type', action='append', default=[])
     opt_parser.add_option('-n', '--no-types', action='store_true')
     opt_parser.add_option('-x', '--hex', action='store_true')
+    opt_parser.add_option('-m', '--mmap', action='store_true')
+    opt_parser.add_option('-l', '--lazy', action='store_true')
+    opt_parser.add_option('--offset', type='int', default=0,
+        help='start of the range to dump with --hex')
+    opt_parser.add_option('--length', type='int',
+        help='size of the range to dump with --hex')
     opts, args = opt_parser.parse_args()
 
     if opts.hex:
         for arg in args:
-            print hexdump(open(arg).read())
+            with open(arg, 'rb') as fh:
+                size = os.fstat(fh.fileno()).st_size
+                raw = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) if size else ''
+                end = size if opts.length is None else min(size, opts.offset + opts.length)
+                for x in _hexdump_raw(buffer(raw, opts.offset, max(0, end - opts.offset)), opts.offset, 4, 16, ''):
+                    sys.stdout.write(x)
         exit()
     
     if opts.no_types:
@@ -491,7 +1605,20 @@ if __name__ == '__main__':
 
 
     for arg in args:
-        parser = Parser(open(arg))
-        parser.parse_all()
-        parser.pprint()
+        parser = Parser(open_file(arg), memory_map=opts.mmap, lazy=opts.lazy)
+        # Print nodes as they are parsed, and forget them as soon as they
+        # are printed, so that memory use does not grow with the file.
+        depth = 0
+        for event, node in parser.iterparse():
+            if event == 'start':
+                print depth * '    ' + ('%s group (%s); %d bytes:' % (node.tag, node.type, node.size))
+                depth += 1
+            elif event == 'chunk':
+                node.pprint(_indent=depth)
+                # Everything before this chunk in its group is done with.
+                node.parent.clear()
+            else:
+                depth -= 1
+                node.parent.clear()
+        parser.close()
 
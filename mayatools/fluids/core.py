@@ -184,7 +184,7 @@ class Frame(object):
             print '\t\tbb_max: %r' % (shape.bb_max, )
 
     def parse_headers(self):
-        self.parser = self.parser or binary.Parser(open(self.path, 'rb'))
+        self.parser = self.parser or binary.Parser(open(self.path, 'rb'), lazy=True, index=True)
         while True:
             if all(tag in self._headers for tag in self._header_tags):
                 break
@@ -226,9 +226,11 @@ class Frame(object):
             self.parse_headers()
             self.parser.parse_all()
             channels = self.parser.find_one('MYCH')
-            for name, data in zip(channels.find('CHNM'), channels.find('FBCA')):
-                name = name.string
-                data = data.floats
+            for name_chunk, data_chunk in zip(channels.find('CHNM'), channels.find('FBCA')):
+                name = name_chunk.string
+                data = data_chunk.floats
+                # Only keep the decoded copy around.
+                data_chunk.release()
                 self._channels[name] = Channel(self, name, data)
 
             for shape in self._shapes.itervalues():
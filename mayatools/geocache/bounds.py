@@ -0,0 +1,315 @@
+"""Per-frame bounds of geometry caches, for culling and memory estimates.
+
+The bounding box of every channel at every frame, and the range of distances
+its points have moved from the first frame, are computed in one pass over a
+cache and stored in a small ``.bounds`` file beside its XML. Anything which
+only needs bounds (importers, farm submitters, etc.) can then read them
+without NumPy and without touching the ``.mc`` files again::
+
+    >>> index = get_bounds('/path/to/cache.xml')
+    >>> index.get_bounds('pSphereShape1', 250)
+    ((-1.0, -1.0, -1.0), (1.0, 1.0, 1.0))
+    >>> index.get_union_bounds()
+    ((-1.0, -1.0, -1.0), (1.0, 3.5, 1.0))
+
+To build them for a whole directory::
+
+    python -m mayatools.geocache.bounds /path/to/caches/*.xml
+
+"""
+
+import array
+import os
+import struct
+
+from multiprocessing.dummy import Pool as ThreadPool
+
+from mayatools import binary
+from mayatools import mcc
+
+
+_nan = float('nan')
+
+
+class BoundsIndex(object):
+
+    """Bounds and displacements of every channel at every frame of a cache.
+
+    Frames are rows, and channels columns, of flat arrays:
+    :attr:`bounds` holds ``(min_x, min_y, min_z, max_x, max_y, max_z)`` and
+    :attr:`displacements` holds ``(min, max)`` distances from the first frame
+    (which are ``nan`` if the point count has changed since). Use
+    :meth:`get_bounds` and friends rather than indexing them directly.
+
+    """
+
+    _header_struct = struct.Struct('>4sHQdLLL')
+    _magic = 'MBND'
+    _version = 1
+
+    _columns = ('times', 'bounds', 'displacements')
+
+    def __init__(self, channel_names=()):
+
+        self.channel_names = list(channel_names)
+        self._channel_ids = dict((name, i) for i, name in enumerate(self.channel_names))
+
+        self.times = array.array('i')
+        self.bounds = array.array('f')
+        self.displacements = array.array('f')
+
+        #: The size and modification time of the XML when it was computed.
+        self.st_size = self.st_mtime = None
+
+        # Maps times to rows; see _cell.
+        self._rows = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def _cell(self, channel, time):
+        try:
+            column = self._channel_ids[channel]
+        except KeyError:
+            raise KeyError('no channel %r' % channel)
+        if self._rows is None or len(self._rows) != len(self.times):
+            self._rows = dict((t, i) for i, t in enumerate(self.times))
+        try:
+            row = self._rows[time]
+        except KeyError:
+            raise KeyError('no time %r' % time)
+        return row * len(self.channel_names) + column
+
+    def get_bounds(self, channel, time):
+        """Get the bounding box of a channel at a time (in ticks).
+
+        :return: ``((min_x, min_y, min_z), (max_x, max_y, max_z))``
+        :raises KeyError: if the channel or time is not in the index.
+
+        """
+        i = self._cell(channel, time) * 6
+        return tuple(self.bounds[i:i + 3]), tuple(self.bounds[i + 3:i + 6])
+
+    def get_displacement(self, channel, time):
+        """Get the ``(min, max)`` distance that the points of a channel have
+        moved from the first frame, at a time (in ticks)."""
+        i = self._cell(channel, time) * 2
+        return tuple(self.displacements[i:i + 2])
+
+    def get_union_bounds(self, channels=None, start=None, end=None):
+        """Get the bounding box of channels over a range of times.
+
+        :param channels: The channels to include, or ``None`` for all.
+        :param int start: The first time (in ticks) to include, or ``None``.
+        :param int end: The last time (in ticks) to include, or ``None``.
+        :return: ``((min_x, min_y, min_z), (max_x, max_y, max_z))``, or
+            ``None`` if nothing was included.
+
+        """
+
+        columns = range(len(self.channel_names)) if channels is None else [self._channel_ids[c] for c in channels]
+        lo = [float('inf')] * 3
+        hi = [float('-inf')] * 3
+        for row, time in enumerate(self.times):
+            if (start is not None and time < start) or (end is not None and time > end):
+                continue
+            for column in columns:
+                i = (row * len(self.channel_names) + column) * 6
+                box = self.bounds[i:i + 6]
+                # Empty channels are nan, which never compare.
+                for axis in xrange(3):
+                    if box[axis] < lo[axis]:
+                        lo[axis] = box[axis]
+                    if box[axis + 3] > hi[axis]:
+                        hi[axis] = box[axis + 3]
+
+        if lo[0] > hi[0]:
+            return None
+        return tuple(lo), tuple(hi)
+
+    def get_max_displacement(self, channel):
+        """Get the furthest that any point of a channel moves from the first frame."""
+        column = self._channel_ids[channel]
+        width = len(self.channel_names)
+        values = [self.displacements[(row * width + column) * 2 + 1] for row in xrange(len(self.times))]
+        values = [v for v in values if v == v]
+        return max(values) if values else None
+
+    def dump(self, file):
+        """Write the index to a file."""
+        names = '\0'.join(self.channel_names)
+        file.write(self._header_struct.pack(
+            self._magic, self._version,
+            self.st_size or 0, self.st_mtime or 0,
+            len(self.times), len(self.channel_names), len(names),
+        ))
+        file.write(names)
+        binary.dump_arrays(file, [getattr(self, name) for name in self._columns])
+
+    @classmethod
+    def load(cls, file):
+        """Read an index from a file written by :meth:`dump`.
+
+        :raises ValueError: if the file is not a bounds index.
+
+        """
+        header = file.read(cls._header_struct.size)
+        if len(header) != cls._header_struct.size:
+            raise ValueError('truncated bounds index')
+        magic, version, st_size, st_mtime, frame_count, channel_count, names_size = cls._header_struct.unpack(header)
+        if magic != cls._magic or version != cls._version:
+            raise ValueError('not a version %d bounds index' % cls._version)
+
+        self = cls(file.read(names_size).split('\0') if channel_count else ())
+        self.st_size = st_size
+        self.st_mtime = st_mtime
+        binary.load_arrays(file, [getattr(self, name) for name in self._columns], [
+            frame_count,
+            frame_count * channel_count * 6,
+            frame_count * channel_count * 2,
+        ])
+        return self
+
+    @classmethod
+    def compute(cls, xml_path, workers=8):
+        """Compute the index of a cache by reading every frame; requires NumPy.
+
+        All channels of a frame are reduced together, so the work per frame
+        is a handful of NumPy calls regardless of how many channels there are.
+
+        :param str xml_path: The XML of the cache.
+        :param int workers: How many threads to read frames with.
+
+        """
+
+        np = binary.np
+        if np is None:
+            raise ImportError('NumPy is required to compute bounds')
+
+        cache = mcc.Cache(xml_path)
+        times = cache.frame_times
+        if not times:
+            raise ValueError('No frames in %r' % xml_path)
+
+        # Only positions have bounds.
+        first = cache.read_frame(times[0])
+        names = [name for name in cache.channel_names if name in first and first[name].ndim == 2]
+        first = [first[name] for name in names]
+        first_all = np.concatenate(first) if first else np.empty((0, 3))
+
+        def reduce_frame(time):
+
+            frame = cache.read_frame(time, names)
+            arrays = [frame[name] for name in names]
+            counts = np.array([len(a) for a in arrays], dtype=int)
+            bounds = np.empty((len(names), 6))
+            bounds.fill(_nan)
+            displacements = np.empty((len(names), 2))
+            displacements.fill(_nan)
+
+            non_empty = counts > 0
+            if not non_empty.any():
+                return bounds, displacements
+            points = np.concatenate(arrays).astype('f8')
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[non_empty]
+            bounds[non_empty, :3] = np.minimum.reduceat(points, starts, axis=0)
+            bounds[non_empty, 3:] = np.maximum.reduceat(points, starts, axis=0)
+
+            # Displacement is only meaningful if the points still match up.
+            same = np.array([len(a) == len(f) for a, f in zip(arrays, first)]) & non_empty
+            if same.all():
+                distances = np.sqrt(((points - first_all) ** 2).sum(axis=1))
+                displacements[:, 0] = np.minimum.reduceat(distances, starts)
+                displacements[:, 1] = np.maximum.reduceat(distances, starts)
+            else:
+                for i in np.flatnonzero(same):
+                    distances = np.sqrt(((arrays[i].astype('f8') - first[i]) ** 2).sum(axis=1))
+                    displacements[i] = distances.min(), distances.max()
+
+            return bounds, displacements
+
+        self = cls(names)
+        pool = ThreadPool(workers)
+        try:
+            for time, (bounds, displacements) in zip(times, pool.imap(reduce_frame, times)):
+                self.times.append(time)
+                self.bounds.fromstring(bounds.astype('=f4').tostring())
+                self.displacements.fromstring(displacements.astype('=f4').tostring())
+        finally:
+            pool.close()
+            pool.join()
+
+        stat = os.stat(xml_path)
+        self.st_size = stat.st_size
+        self.st_mtime = stat.st_mtime
+        return self
+
+
+def get_bounds_path(xml_path):
+    """Get the path of the bounds index beside a cache's XML."""
+    return os.path.splitext(xml_path)[0] + '.bounds'
+
+
+def get_bounds(xml_path, compute=True, force=False):
+    """Get the :class:`BoundsIndex` of a cache, computing it if required.
+
+    Indexes are stored beside the XML (see :func:`get_bounds_path`), and are
+    reused as long as the size and modification time of the XML (which Maya
+    rewrites with every export) have not changed. Failure to write the index
+    is ignored.
+
+    :param str xml_path: The XML of the cache.
+    :param bool compute: Compute the index if there is no valid one;
+        otherwise ``None`` is returned.
+    :param bool force: Compute the index even if there is a valid one.
+
+    """
+
+    stat = os.stat(xml_path)
+    bounds_path = get_bounds_path(xml_path)
+
+    if not force:
+        try:
+            with open(bounds_path, 'rb') as fh:
+                index = BoundsIndex.load(fh)
+        except (IOError, ValueError):
+            pass
+        else:
+            if index.st_size == stat.st_size and index.st_mtime == stat.st_mtime:
+                return index
+
+    if not compute:
+        return
+
+    index = BoundsIndex.compute(xml_path)
+    binary.atomic_write(bounds_path, index.dump)
+    return index
+
+
+def main():
+
+    from optparse import OptionParser
+
+    opt_parser = OptionParser(usage='%prog [options] cache.xml ...')
+    opt_parser.add_option('-f', '--force', action='store_true', help='recompute existing indexes')
+    opts, args = opt_parser.parse_args()
+
+    if not args:
+        opt_parser.print_usage()
+        exit(1)
+
+    for xml_path in args:
+        index = get_bounds(xml_path, force=opts.force)
+        print '%s (%d frames)' % (xml_path, len(index))
+        for name in index.channel_names:
+            union = index.get_union_bounds([name])
+            print '\t%s: %s to %s, moves up to %s' % (
+                name,
+                union[0] if union else '-',
+                union[1] if union else '-',
+                index.get_max_displacement(name),
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+"""Retime geometry caches without Maya.
+
+This mirrors :mod:`mayatools.fluids.retime`, but for point caches: every
+destination frame is a weighted blend of whole channels from the nearest
+source frames (two for linear interpolation, or four for cubic), computed
+with NumPy across local processes::
+
+    python -m mayatools.geocache.retime --src-start 1 --src-end 100 \\
+        --start 1 --end 200 --cubic input.xml output.xml
+
+"""
+
+import bisect
+import multiprocessing
+import os
+
+from optparse import OptionParser
+
+from mayatools import mcc
+
+
+def frange(a, b, step):
+    v = float(a)
+    b = float(b)
+    step = float(step)
+    while v <= b:
+        yield v
+        v += step
+
+
+def iter_ticks(src_start, src_end, dst_start, dst_end, sampling_rate):
+    for dst_time in frange(dst_start, dst_end, sampling_rate):
+        if dst_end == dst_start:
+            src_time = src_start
+        else:
+            src_time = src_start + (src_end - src_start) * (dst_time - dst_start) / (dst_end - dst_start)
+        yield src_time, dst_time
+
+
+def get_weights(src_times, src_time, cubic=False, time_per_frame=mcc.ticks_per_frame):
+    """Get the source frames and weights to blend for the given time.
+
+    Cubic interpolation is Catmull-Rom over the two frames on either side,
+    with the end frames repeated at the edges of the cache.
+
+    :param list src_times: The sorted times which have data.
+    :param float src_time: The time to sample.
+    :param bool cubic: Use cubic instead of linear interpolation.
+    :param int time_per_frame: Ticks per frame, for error messages.
+    :return list: ``(time, weight)`` pairs, which sum to one.
+    :raises ValueError: if the time is outside of the source times.
+
+    """
+
+    if not src_times or src_time < src_times[0] or src_time > src_times[-1]:
+        def format_time(time):
+            frames, ticks = divmod(time, time_per_frame)
+            return '%d:%d' % (frames, ticks)
+        raise ValueError('Cannot find data for time %s; have from %s to %s' % (
+            format_time(src_time),
+            format_time(src_times[0]) if src_times else '-',
+            format_time(src_times[-1]) if src_times else '-',
+        ))
+
+    b = bisect.bisect_left(src_times, src_time)
+    if src_times[b] == src_time:
+        return [(src_times[b], 1.0)]
+    a = b - 1
+
+    t = float(src_time - src_times[a]) / float(src_times[b] - src_times[a])
+    if not cubic:
+        return [(src_times[a], 1.0 - t), (src_times[b], t)]
+
+    t2 = t * t
+    t3 = t2 * t
+    indices = (max(a - 1, 0), a, b, min(b + 1, len(src_times) - 1))
+    weights = (
+        0.5 * (-t + 2 * t2 - t3),
+        0.5 * (2 - 5 * t2 + 3 * t3),
+        0.5 * (t + 4 * t2 - 3 * t3),
+        0.5 * (-t2 + t3),
+    )
+
+    # Repeated end frames are merged.
+    res = []
+    for index, weight in zip(indices, weights):
+        if res and res[-1][0] == src_times[index]:
+            res[-1] = (res[-1][0], res[-1][1] + weight)
+        else:
+            res.append((src_times[index], weight))
+    return res
+
+
+def schedule_retime(
+    src_path, dst_path,
+    src_start=None, src_end=None,
+    dst_start=None, dst_end=None,
+    sampling_rate=1.0,
+    workers=None,
+    verbose=0,
+    cubic=False,
+):
+    """Retime a geometry cache into a new OneFilePerFrame cache.
+
+    Times are given in frames, and default as they do for
+    :func:`mayatools.fluids.retime.schedule_retime`: the destination range
+    defaults to that of the source, and the source range to the destination.
+
+    :param str src_path: The XML of the cache to read.
+    :param str dst_path: The XML of the cache to write.
+    :param float sampling_rate: Frames between samples of the new cache.
+    :param int workers: How many processes to blend with; ``None`` for one
+        per CPU, or ``1`` to blend in this process.
+    :param bool cubic: Use cubic instead of linear interpolation.
+    :return list: The ``.mc`` files which were written.
+
+    """
+
+    dst_path = os.path.abspath(dst_path)
+    src_path = os.path.abspath(src_path)
+
+    if os.path.splitext(dst_path)[1] != '.xml':
+        raise ValueError('destination must be an .xml; got %r' % dst_path)
+    dst_directory = os.path.dirname(dst_path)
+    if not os.path.exists(dst_directory):
+        os.makedirs(dst_directory)
+
+    src_cache = mcc.Cache(src_path)
+    src_times = src_cache.frame_times
+    if not src_times:
+        raise ValueError('No frames in %r' % src_path)
+
+    # Convert all time options into ticks, at the frame rate of the source.
+    ticks_per_frame = src_cache.time_per_frame
+    dst_start = src_times[0] if dst_start is None else int(dst_start * ticks_per_frame)
+    dst_end = src_times[-1] if dst_end is None else int(dst_end * ticks_per_frame)
+    src_start = dst_start if src_start is None else int(src_start * ticks_per_frame)
+    src_end = dst_end if src_end is None else int(src_end * ticks_per_frame)
+
+    # This one remains a float.
+    sampling_rate = sampling_rate * ticks_per_frame
+
+    # Keep the precision of the source.
+    double = any(a.dtype.itemsize == 8 for a in src_cache.read_frame(src_times[0]).itervalues())
+
+    tasks = []
+    for src_time, dst_time in iter_ticks(src_start, src_end, dst_start, dst_end, sampling_rate):
+        dst_time = int(round(dst_time))
+        weights = get_weights(src_times, src_time, cubic, ticks_per_frame)
+        tasks.append((src_path, weights, dst_path, dst_time, ticks_per_frame, double))
+        if verbose:
+            print 'Blend %d from %s' % (dst_time, ', '.join('%d*%.3f' % w for w in weights))
+
+    if workers == 1:
+        dst_frame_paths = map(blend_one, tasks)
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            # Contiguous chunks let workers reuse the frames they just read.
+            chunksize = max(1, len(tasks) // (4 * (workers or multiprocessing.cpu_count())))
+            dst_frame_paths = pool.map(blend_one, tasks, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+    # Frames stay as long as the source's; only the sampling changes.
+    mcc.write_xml(dst_path, src_cache.channel_names, [t[3] for t in tasks],
+        time_per_frame=ticks_per_frame,
+        sampling_rate=int(round(sampling_rate)),
+        double=double,
+    )
+
+    return dst_frame_paths
+
+
+# Per-process caches of the source caches and their recently read frames.
+_caches = {}
+_frames = []
+_frames_size = 4
+
+
+def _read_source_frame(src_path, time):
+
+    for key, frame in _frames:
+        if key == (src_path, time):
+            return frame
+
+    cache = _caches.get(src_path)
+    if cache is None:
+        cache = _caches[src_path] = mcc.Cache(src_path)
+    frame = cache.read_frame(time)
+
+    _frames.append(((src_path, time), frame))
+    del _frames[:-_frames_size]
+    return frame
+
+
+def blend_one(args):
+    """Blend and write one destination frame; run by :func:`schedule_retime`.
+
+    :param tuple args: ``(src_path, weights, dst_path, dst_time, time_per_frame, double)``.
+    :return str: The ``.mc`` which was written.
+
+    """
+
+    src_path, weights, dst_path, dst_time, time_per_frame, double = args
+
+    frames = [(_read_source_frame(src_path, time), weight) for time, weight in weights]
+
+    channels = []
+    for name in _caches[src_path].channel_names:
+        blended = None
+        for frame, weight in frames:
+            data = frame[name].astype('f8')
+            if blended is None:
+                blended = data * weight
+            else:
+                blended += data * weight
+        channels.append((name, blended))
+
+    dst_frame_path = mcc.get_frame_path(dst_path, dst_time, time_per_frame)
+    mcc.write_frame(dst_frame_path, dst_time, channels, double=double)
+    return dst_frame_path
+
+
+def main():
+
+    option_parser = OptionParser(usage='%prog [options] input.xml, output.xml')
+    option_parser.add_option('-s', '--start', type='float')
+    option_parser.add_option('-e', '--end', type='float')
+    option_parser.add_option('--src-start', '--os', type='float')
+    option_parser.add_option('--src-end', '--oe', type='float')
+    option_parser.add_option('-r', '--rate', type='float', default=1.0)
+    option_parser.add_option('-v', '--verbose', action='count', default=0)
+    option_parser.add_option('-w', '--workers', type='int')
+    option_parser.add_option('-c', '--cubic', action='store_true')
+    opts, args = option_parser.parse_args()
+
+    if len(args) != 2:
+        option_parser.print_usage()
+        exit(1)
+
+    schedule_retime(*args,
+        src_start=opts.src_start,
+        src_end=opts.src_end,
+        dst_start=opts.start,
+        dst_end=opts.end,
+        sampling_rate=opts.rate,
+        verbose=opts.verbose,
+        workers=opts.workers,
+        cubic=opts.cubic
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+"""Check geometry caches for problems before they reach the farm.
+
+Every frame of a cache is checked against its XML in parallel (as the work is
+dominated by I/O on network storage), looking for missing frames, truncated
+or corrupt files, missing or unexpected channels, point counts which differ
+from the first frame, and data types which differ from the XML. Results are
+reported as JSON::
+
+    python -m mayatools.geocache.validate /path/to/cache/directory
+
+"""
+
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import time as _time
+import xml.etree.cElementTree as etree
+
+from multiprocessing.dummy import Pool as ThreadPool
+
+from mayatools import binary
+from mayatools import mcc
+
+
+# Maps XML channel types to the tags their data should be stored in.
+_channel_type_tags = {
+    'FloatVectorArray': 'FVCA',
+    'DoubleVectorArray': 'DVCA',
+    'FloatArray': 'FBCA',
+    'DoubleArray': 'DBLA',
+}
+
+
+def _error(kind, message, time=None, path=None, channel=None):
+    error = {'kind': kind, 'message': message}
+    if time is not None:
+        error['time'] = time
+    if path is not None:
+        error['path'] = path
+    if channel is not None:
+        error['channel'] = channel
+    return error
+
+
+def _scan_group(group, headers, channels, errors):
+    """Collect the headers and ``(name, size, tag, nbytes)`` channels of a
+    parsed group, appending to ``errors`` if a chunk overruns it."""
+    name = size = None
+    for chunk in group.children:
+        if isinstance(chunk, binary.Node):
+            continue
+        if chunk.offset + chunk.size > group.end:
+            errors.append(_error('corrupt', '%s chunk at byte %d overruns its %s group' % (chunk.tag, chunk.offset, group.tag)))
+            break
+        if chunk.tag in ('STIM', 'ETIM', 'TIME') and chunk.size == 4:
+            headers[chunk.tag] = chunk.ints[0]
+        elif chunk.tag == 'CHNM':
+            name = chunk.string
+        elif chunk.tag == 'SIZE' and chunk.size == 4:
+            size = chunk.ints[0]
+        elif chunk.tag in mcc.channel_dtypes:
+            channels.append((name, size, chunk.tag, chunk.size))
+            name = size = None
+
+
+def _read_channels(path):
+    """Parse the structure of a ``.mc``, and return its headers and channels.
+
+    :return: ``(headers, channels, errors)``, where ``headers`` maps
+        ``STIM``/``ETIM`` to values and ``channels`` is a list of
+        ``(name, size, tag, nbytes)`` tuples.
+
+    """
+
+    headers = {}
+    channels = []
+    errors = []
+
+    with open(path, 'rb') as fh:
+
+        file_size = os.fstat(fh.fileno()).st_size
+        if not file_size:
+            return headers, channels, [_error('truncated', 'empty file')]
+
+        # Memory mapped and lazy, so only the headers are touched.
+        parser = binary.Parser(fh, memory_map=True, lazy=True)
+        try:
+
+            try:
+                parser.parse_all()
+            except (struct.error, AssertionError, ValueError) as e:
+                errors.append(_error('corrupt', 'could not parse structure near byte %d: %s' % (parser.tell(), e)))
+
+            for group in parser.children:
+                if group.end > file_size:
+                    errors.append(_error('truncated', '%s group ends at byte %d, but the file is %d bytes' % (group.tag, group.end, file_size)))
+                    continue
+                _scan_group(group, headers, channels, errors)
+
+        finally:
+            parser.close()
+
+    return headers, channels, errors
+
+
+def _check_channels(raw_channels, expected_channels, time, path, errors):
+    """Check ``(name, size, tag, nbytes)`` tuples against the expected
+    channels, appending to ``errors``, and return a ``dict`` mapping the
+    names found to their ``(size, tag)``."""
+
+    channels = {}
+    for name, size, tag, nbytes in raw_channels:
+
+        channels[name] = (size, tag)
+        dtype, width = mcc.channel_dtypes[tag]
+        if size is None or nbytes != size * width * int(dtype[-1]):
+            errors.append(_error('corrupt', '%s has %d bytes for %s points' % (tag, nbytes, size), time, path, name))
+
+        if name not in expected_channels:
+            errors.append(_error('channels', 'unexpected channel', time, path, name))
+            continue
+        expected_size, expected_tag = expected_channels[name]
+        if expected_size is not None and size != expected_size:
+            errors.append(_error('point_count', '%s points, but expected %d' % (size, expected_size), time, path, name))
+        if expected_tag is not None and tag != expected_tag:
+            errors.append(_error('channel_type', '%s data, but expected %s' % (tag, expected_tag), time, path, name))
+
+    # Channels lost to a broken file have already been reported.
+    if not any(e['kind'] in ('truncated', 'corrupt') for e in errors):
+        for name in sorted(set(expected_channels).difference(channels)):
+            errors.append(_error('channels', 'missing channel', time, path, name))
+
+    return channels
+
+
+def check_frame(path, time, expected_channels):
+    """Check one frame of a OneFilePerFrame cache.
+
+    :param str path: The ``.mc`` file.
+    :param int time: The time the file should be for.
+    :param dict expected_channels: Maps channel names to their expected
+        ``(size, tag)``; either may be ``None`` if it is unknown.
+    :return: ``(channels, errors)``, where ``channels`` maps the channel
+        names found to their ``(size, tag)``.
+
+    """
+
+    if not os.path.exists(path):
+        return {}, [_error('missing', 'frame does not exist', time, path)]
+
+    try:
+        headers, raw_channels, errors = _read_channels(path)
+    except (IOError, OSError, mmap.error) as e:
+        return {}, [_error('unreadable', str(e), time, path)]
+
+    for error in errors:
+        error.update(time=time, path=path)
+
+    for key in ('STIM', 'ETIM'):
+        if key in headers and headers[key] != time:
+            errors.append(_error('time', '%s is %d' % (key, headers[key]), time, path))
+
+    channels = _check_channels(raw_channels, expected_channels, time, path, errors)
+    return channels, errors
+
+
+def _check_one_file(cache, expected_channels, report, pool):
+
+    path = cache.get_frame_path(None)
+    if not os.path.exists(path):
+        report['errors'].append(_error('missing', 'cache does not exist', path=path))
+        return
+
+    try:
+        index = mcc.build_time_index(path)
+    except mcc.ParseError as e:
+        report['errors'].append(_error('corrupt', str(e), path=path))
+        return
+
+    file_size = os.path.getsize(path)
+
+    def check_time(time):
+        if time not in index:
+            return {}, [_error('missing', 'time is not in the cache', time, path)]
+        offset, size = index[time]
+        if offset + size > file_size:
+            return {}, [_error('truncated', 'MYCH group ends at byte %d, but the file is %d bytes' % (offset + size, file_size), time, path)]
+        errors = []
+        raw_channels = []
+        try:
+            with open(path, 'rb') as fh:
+                _scan_group(mcc.parse_time_group(fh, index[time]), {}, raw_channels, errors)
+        except (IOError, mcc.ParseError) as e:
+            errors.append(_error('corrupt', str(e), time, path))
+        for error in errors:
+            error.update(time=time, path=path)
+        channels = _check_channels(raw_channels, expected_channels, time, path, errors)
+        return channels, errors
+
+    times = cache.times
+    _fill_expected_sizes(expected_channels, check_time(times[0])[0] if times else {})
+    for channels, errors in pool.imap(check_time, times):
+        report['errors'].extend(errors)
+    report['frames_checked'] = len(times)
+
+    for time in sorted(set(index).difference(times)):
+        report['errors'].append(_error('unexpected_frame', 'time is outside of the XML range', time, path))
+
+
+def _fill_expected_sizes(expected_channels, first_channels):
+    # The XML doesn't record point counts, so the first frame is the reference.
+    for name, (size, tag) in first_channels.iteritems():
+        if name in expected_channels and size is not None:
+            expected_channels[name] = (size, expected_channels[name][1])
+
+
+def validate(xml_path, workers=16):
+    """Check every frame of a cache against its XML.
+
+    :param str xml_path: The XML file of the cache.
+    :param int workers: How many threads to check frames with.
+    :return: A JSON-able ``dict`` report, with a list of ``errors`` (each a
+        ``dict`` with a ``kind``, ``message``, and where relevant the
+        ``time``, ``path`` and ``channel``), and ``ok`` if there were none.
+
+    """
+
+    start_clock = _time.time()
+    xml_path = os.path.abspath(xml_path)
+    report = {
+        'xml_path': xml_path,
+        'errors': [],
+        'frames_checked': 0,
+    }
+
+    try:
+        cache = mcc.Cache(xml_path)
+        tree = etree.parse(xml_path)
+    except (IOError, SyntaxError, AttributeError, TypeError, ValueError) as e:
+        report['errors'].append(_error('xml', 'could not read XML: %s' % e, path=xml_path))
+        report['ok'] = False
+        return report
+
+    report.update(
+        cache_type=cache.cache_type,
+        range=[cache.start_time, cache.end_time],
+        time_per_frame=cache.time_per_frame,
+        sampling_rate=cache.sampling_rate,
+    )
+
+    expected_channels = {}
+    for element in tree.find('Channels'):
+        expected_channels[element.get('ChannelName')] = (None, _channel_type_tags.get(element.get('ChannelType')))
+
+    pool = ThreadPool(workers)
+    try:
+
+        if cache.cache_type == 'OneFile':
+            _check_one_file(cache, expected_channels, report, pool)
+
+        elif cache.cache_type == 'OneFilePerFrame':
+
+            times = cache.times
+            if times:
+                first = check_frame(cache.get_frame_path(times[0]), times[0], expected_channels)
+                _fill_expected_sizes(expected_channels, first[0])
+
+            args = [(cache.get_frame_path(time), time, expected_channels) for time in times]
+            for channels, errors in pool.imap(lambda a: check_frame(*a), args):
+                report['errors'].extend(errors)
+            report['frames_checked'] = len(times)
+
+            # Look for frames which the XML does not account for.
+            expected_names = set(os.path.basename(path) for path, time, channels in args)
+            name_re = re.compile(r'^%sFrame\d+(Tick\d+)?\.mc$' % re.escape(cache.base_name))
+            for name in sorted(os.listdir(cache.directory)):
+                if name_re.match(name) and name not in expected_names:
+                    report['errors'].append(_error('unexpected_frame', 'frame is outside of the XML range', path=os.path.join(cache.directory, name)))
+
+        else:
+            report['errors'].append(_error('xml', 'unknown cache type %r' % cache.cache_type, path=xml_path))
+
+    finally:
+        pool.close()
+        pool.join()
+
+    report['channels'] = dict((name, {'size': size, 'type': tag}) for name, (size, tag) in expected_channels.iteritems())
+    report['ok'] = not report['errors']
+    report['seconds'] = _time.time() - start_clock
+    return report
+
+
+def find_caches(directory):
+    """Find the XML files of all caches in a directory."""
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith('.xml')]
+
+
+def main():
+
+    from optparse import OptionParser
+
+    opt_parser = OptionParser(usage='%prog [options] (cache.xml | directory) ...')
+    opt_parser.add_option('-w', '--workers', type='int', default=16)
+    opt_parser.add_option('-o', '--output', help='write the JSON report to this file')
+    opts, args = opt_parser.parse_args()
+
+    if not args:
+        opt_parser.print_usage()
+        exit(1)
+
+    xml_paths = []
+    for arg in args:
+        xml_paths.extend(find_caches(arg) if os.path.isdir(arg) else [arg])
+
+    reports = [validate(path, workers=opts.workers) for path in xml_paths]
+
+    if opts.output:
+        with open(opts.output, 'w') as fh:
+            json.dump(reports, fh, indent=4, sort_keys=True)
+    else:
+        json.dump(reports, sys.stdout, indent=4, sort_keys=True)
+        print
+
+    for report in reports:
+        print >> sys.stderr, '%s: %s (%d errors in %d frames)' % (
+            report['xml_path'],
+            'ok' if report['ok'] else 'FAILED',
+            len(report['errors']),
+            report['frames_checked'],
+        )
+
+    exit(0 if all(r['ok'] for r in reports) else 2)
+
+
+if __name__ == '__main__':
+    main()
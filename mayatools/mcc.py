@@ -1,17 +1,226 @@
+import filecmp
+import itertools
+import json
 import os
+import Queue
+import re
 import struct
-import glob
+import threading
+import weakref
+import xml.etree.cElementTree as etree
+
+from . import binary
+
 
 class ParseError(RuntimeError):
     pass
 
 
-_get_channels_results = {}
+#: How many results :func:`get_channels` keeps in memory.
+channel_cache_size = 256
+
+# Maps .mc paths to (last_use, (st_size, st_mtime, channels)).
+_channel_cache = {}
+_channel_cache_clock = itertools.count()
+
+
+def _load_json_cache(namespace, path, stat):
+    """Load data stored by :func:`_dump_json_cache`, if the file at ``path``
+    has not changed since."""
+    try:
+        with open(binary.get_cache_path(namespace, path, '.json')) as fh:
+            raw = json.load(fh)
+        if raw['st_size'] == stat.st_size and raw['st_mtime'] == stat.st_mtime:
+            return raw['data']
+    except (IOError, ValueError, KeyError, TypeError):
+        pass
+
+
+def _dump_json_cache(namespace, path, stat, data):
+    """Store data derived from the file at ``path`` in the user's cache
+    directory; failures are ignored."""
+    raw = {
+        'path': path,
+        'st_size': stat.st_size,
+        'st_mtime': stat.st_mtime,
+        'data': data,
+    }
+    binary.atomic_write(binary.get_cache_path(namespace, path, '.json'), lambda fh: json.dump(raw, fh), 'w')
+
+
+def _get_cached_channels(mcc_path, stat):
+
+    entry = _channel_cache.get(mcc_path, (None, None))[1]
+
+    if entry is None:
+        channels = _load_json_cache('mcc-channels', mcc_path, stat)
+        if channels is None:
+            return
+        entry = (stat.st_size, stat.st_mtime, _normalize_channels(channels))
+
+    if entry[0] != stat.st_size or entry[1] != stat.st_mtime:
+        return
+
+    _remember_channels(mcc_path, entry)
+    return entry[2]
+
+
+def _remember_channels(mcc_path, entry):
+    _channel_cache[mcc_path] = (next(_channel_cache_clock), entry)
+    # Evict the least recently used.
+    while len(_channel_cache) > channel_cache_size:
+        del _channel_cache[min(_channel_cache, key=lambda k: _channel_cache[k][0])]
+
+
+def _normalize_channels(channels):
+    # The same types however the channels were found; JSON gives unicode
+    # names, and parsing may give long sizes.
+    return [(str(name), int(size)) for name, size in channels]
+
+
+def _store_channels(mcc_path, stat, channels):
+    channels = _normalize_channels(channels)
+    _remember_channels(mcc_path, (stat.st_size, stat.st_mtime, channels))
+    _dump_json_cache('mcc-channels', mcc_path, stat, channels)
+    return channels
+
+
+#: Maya time units per frame at 24fps; used to name frame files when there
+#: is no XML to give the cache's ``cacheTimePerFrame``.
+ticks_per_frame = 250
+
+# Maps directories to (st_mtime, names).
+_listing_cache = {}
+
+
+def _list_directory(directory):
+    mtime = os.stat(directory).st_mtime
+    entry = _listing_cache.get(directory)
+    if entry is None or entry[0] != mtime:
+        if len(_listing_cache) >= channel_cache_size:
+            _listing_cache.clear()
+        entry = _listing_cache[directory] = (mtime, os.listdir(directory))
+    return entry[1]
+
+
+def get_frame_path(xml_path, time, time_per_frame=None):
+    """Get the path of the ``.mc`` file for the given time in a OneFilePerFrame cache.
+
+    :param str xml_path: The XML file for the cache.
+    :param int time: The time in ticks; e.g. ``250`` is frame 1 at 24fps.
+    :param int time_per_frame: Ticks per frame, which Maya names the files
+        by; read from the XML if ``None`` (see :func:`get_time_per_frame`).
+    :return str: A path like ``/path/to/cacheFrame1.mc`` or
+        ``/path/to/cacheFrame1Tick125.mc``; it may not exist.
+
+    """
+    if time_per_frame is None:
+        time_per_frame = get_time_per_frame(xml_path)
+    frame, tick = divmod(int(time), time_per_frame)
+    base_path = os.path.splitext(xml_path)[0]
+    if tick:
+        return '%sFrame%dTick%d.mc' % (base_path, frame, tick)
+    return '%sFrame%d.mc' % (base_path, frame)
+
+
+def _parse_time_range(xml_tree):
+    m = re.match(r'^\s*(-?\d+)\s*-\s*(-?\d+)\s*$', xml_tree.find('time').get('Range'))
+    if not m:
+        raise ValueError('bad time range')
+    return int(m.group(1)), int(m.group(2))
+
+
+def _parse_time_per_frame(xml_tree):
+    return int(xml_tree.find('cacheTimePerFrame').get('TimePerFrame'))
+
+
+def get_time_per_frame(xml_path):
+    """Get the ticks per frame of a cache from its XML.
+
+    :param str xml_path: The XML file for the cache.
+    :return int: The ``cacheTimePerFrame``, or :data:`ticks_per_frame` if
+        the XML cannot be read or does not say.
+
+    """
+    try:
+        return _parse_time_per_frame(etree.parse(xml_path))
+    except (IOError, SyntaxError, AttributeError, TypeError, ValueError):
+        return ticks_per_frame
+
+
+def get_first_frame_path(xml_path):
+    """Get the path of the first ``.mc`` file in a OneFilePerFrame cache.
+
+    The path is derived from the time range in the XML when possible, so that
+    large directories don't need to be listed. Otherwise, the directory
+    listing (which is cached until the directory changes) is searched for the
+    lowest numbered frame.
+
+    :param str xml_path: The XML file for the cache.
+    :return str: The path, or ``None`` if there are no frames.
+
+    """
+
+    try:
+        tree = etree.parse(xml_path)
+    except (IOError, SyntaxError):
+        tree = None
+
+    try:
+        time_per_frame = _parse_time_per_frame(tree)
+    except (AttributeError, TypeError, ValueError):
+        time_per_frame = ticks_per_frame
+
+    try:
+        start = _parse_time_range(tree)[0]
+    except (AttributeError, TypeError, ValueError):
+        pass
+    else:
+        path = get_frame_path(xml_path, start, time_per_frame)
+        if os.path.exists(path):
+            return path
+
+    frames = list(_iter_frame_files(xml_path, time_per_frame))
+    if frames:
+        return os.path.join(os.path.dirname(xml_path), min(frames)[1])
+
+
+def _iter_frame_files(xml_path, time_per_frame):
+    """Yield ``(time, file_name)`` for each ``.mc`` of a OneFilePerFrame cache."""
+    directory, name = os.path.split(xml_path)
+    name_re = re.compile(r'^%sFrame(\d+)(?:Tick(\d+))?\.mc$' % re.escape(os.path.splitext(name)[0]))
+    for file_name in _list_directory(directory or '.'):
+        m = name_re.match(file_name)
+        if m:
+            yield int(m.group(1)) * time_per_frame + int(m.group(2) or 0), file_name
+
+
+def get_frame_times(xml_path, time_per_frame=None):
+    """Get the times of every ``.mc`` file which exists for a OneFilePerFrame cache.
+
+    This uses the same cached directory listing as :func:`get_first_frame_path`.
+
+    :param str xml_path: The XML file for the cache.
+    :param int time_per_frame: Ticks per frame; see :func:`get_frame_path`.
+    :return list: The sorted times, in ticks.
+
+    """
+    if time_per_frame is None:
+        time_per_frame = get_time_per_frame(xml_path)
+    return sorted(time for time, file_name in _iter_frame_files(xml_path, time_per_frame))
 
 
 def get_channels(xml_path, memoize=True):
     """Get a list of channel names and their point counts from a Maya MCC cache.
     
+    Results are memoized in memory (for the most recent
+    :data:`channel_cache_size` caches) and on disk in the user's cache
+    directory, and are reused as long as the size and modification time of
+    the first frame are unchanged.
+
+    OneFile caches (as the XML's ``cacheType`` says) are supported too, in
+    which case the first time in the file is used (see :func:`get_time_index`).
+
     :param str xml_path: The XML file for the given cache.
     :param bool memoize: Use memoization to avoid parsing?
     :return: List of ``(name, size)`` tuples for each channel.
@@ -19,82 +228,815 @@ def get_channels(xml_path, memoize=True):
     
     """
     
-    mcc_paths = glob.glob(os.path.join(os.path.dirname(xml_path), os.path.splitext(os.path.basename(xml_path))[0] + 'Frame*.mc'))
-    if not mcc_paths:
-        raise ParseError('Could not find any *.mc for %r' % xml_path)
-    mcc_path = mcc_paths[0]
+    try:
+        one_file = etree.parse(xml_path).find('cacheType').get('Type') == 'OneFile'
+    except (IOError, SyntaxError, AttributeError):
+        one_file = False
+
+    if one_file:
+        # OneFile caches have a single .mc named like the XML.
+        mcc_path = os.path.splitext(xml_path)[0] + '.mc'
+        if not os.path.exists(mcc_path):
+            raise ParseError('Could not find %r for %r' % (mcc_path, xml_path))
+    else:
+        mcc_path = get_first_frame_path(xml_path)
+        if mcc_path is None:
+            raise ParseError('Could not find any *.mc for %r' % xml_path)
     stat = os.stat(mcc_path)
     
     # Return memoized results.
-    if (mcc_path in _get_channels_results and
-        _get_channels_results[mcc_path][0] == stat.st_size and
-        _get_channels_results[mcc_path][1] == stat.st_mtime
-    ):
-        # Return a copy of the list.
-        return list(_get_channels_results[mcc_path][2])
-    
-    fh = open(mcc_path, 'rb')
-    
-    # File header block.
-    tag = fh.read(4)
-    if tag != 'FOR4':
-        raise RuntimeError('bad FOR4 tag %r @ %x' % (tag, fh.tell()))
-    offset = struct.unpack('>i', fh.read(4))[0]
-    fh.seek(offset, 1)
+    if memoize:
+        channels = _get_cached_channels(mcc_path, stat)
+        if channels is not None:
+            # Return a copy of the list.
+            return list(channels)
     
-    # Channel data block.
-    tag = fh.read(4)
-    if tag != 'FOR4':
-        raise RuntimeError('bad FOR4 tag %r @ %x' % (tag, fh.tell()))
-    
-    # Start of channel data.
-    offset = struct.unpack('>i', fh.read(4))[0]
-    tag = fh.read(4)
-    if tag != 'MYCH':
-        raise RuntimeError('bad MYCH tag %r @ %x' % (tag, fh.tell()))
-    
-    channels = []
-    while True:
-        
-        # Channel name.
-        tag = fh.read(4)
-        if not tag:
-            # We have reached the end of the file, and so we are done.
-            break
-        if tag != 'CHNM':
-            raise RuntimeError('bad CHNM tag %r @ %x' % (tag, fh.tell()))
-        name_size = struct.unpack('>i', fh.read(4))[0]
-        name = fh.read(name_size)[:-1]
-
-        # The stored name is padded to the next 4-byte boundary.
-        mask = 3
-        padded = (name_size + mask) & (~mask)
-        padding = padded - name_size
-        if padding:
-            fh.seek(padding, 1)
-        
-        # Channel size (e.g. point count).
-        tag = fh.read(4)
-        if tag != 'SIZE':
-            raise RuntimeError('bad SIZE tag %r @ %x' % (tag, fh.tell()))
-        point_count_size = struct.unpack('>i', fh.read(4))[0]
-        if point_count_size != 4:
-            raise RuntimeError('bad point_count_size %r @ %x' % (point_count_size, fh.tell()))
-        point_count = struct.unpack('>i', fh.read(point_count_size))[0]
-        
-        channels.append((name, point_count))
-        
-        # Skip the actual data.
-        tag = fh.read(4)
-        if tag == 'FVCA':
-            fh.seek(3 * 4 * point_count + 4, 1)
-        elif tag == 'DVCA':
-            fh.seek(3 * 8 * point_count + 4, 1)
-        else:
-            raise RuntimeError('bad FVCA/DVCA tag %r @ %x' % (tag, fh.tell()))
+    if one_file:
+        time_index = get_time_index(mcc_path)
+        if not time_index:
+            raise ParseError('no MYCH group in %r' % mcc_path)
+        # Only the headers of the point data are read.
+        with open(mcc_path, 'rb') as fh:
+            group = parse_time_group(fh, time_index[min(time_index)])
+            channels = [(name, size) for name, size, chunk in iter_channels(group)]
+
+    else:
+        # Only the channel names and sizes are read; the rest is seeked past.
+        with open(mcc_path, 'rb') as fh:
+            parser = binary.Parser(fh, index=True)
+            parser.parse_all(include_tags=('CHNM', 'SIZE'), skip_tags=('CACH', ))
+
+        channel_group = parser.find_one('MYCH', None)
+        if channel_group is None:
+            raise ParseError('no MYCH group in %r' % mcc_path)
+        names = [chunk.string for chunk in channel_group.find('CHNM')]
+        sizes = [chunk.ints[0] for chunk in channel_group.find('SIZE')]
+        if len(names) != len(sizes):
+            raise ParseError('%d CHNM but %d SIZE in %r' % (len(names), len(sizes), mcc_path))
+        channels = zip(names, sizes)
     
     # Memoize the result.
-    _get_channels_results[mcc_path] = (stat.st_size, stat.st_mtime, channels)
+    channels = _store_channels(mcc_path, stat, channels)
     
-    return channels
+    return list(channels)
+
+
+#: Maps the tags of point data chunks to their dtype and the number of values
+#: per point.
+channel_dtypes = {
+    'FVCA': ('>f4', 3),
+    'DVCA': ('>f8', 3),
+    'FBCA': ('>f4', 1),
+    'DBLA': ('>f8', 1),
+}
+
+
+def iter_channels(group):
+    """Iterate over the channels of a parsed ``MYCH`` group.
+
+    :param group: The :class:`~mayatools.binary.Group`; with lazy chunks only
+        the ``CHNM`` and ``SIZE`` data is read.
+    :return: Iterator of ``(name, size, chunk)`` tuples, where ``chunk`` is
+        the point data, and ``size`` may be ``None`` if there was no ``SIZE``.
+
+    """
+    name = size = None
+    for chunk in group.children:
+        if chunk.tag == 'CHNM':
+            name = chunk.string
+        elif chunk.tag == 'SIZE':
+            size = chunk.ints[0]
+        elif chunk.tag in channel_dtypes and not isinstance(chunk, binary.Node):
+            yield name, size, chunk
+
+
+def _decode_channels(group, wanted):
+    res = {}
+    for name, size, chunk in iter_channels(group):
+        if wanted is None or name in wanted:
+            dtype, width = channel_dtypes[chunk.tag]
+            array = chunk.as_array(dtype)
+            res[name] = array.reshape(-1, width) if width > 1 else array
+    return res
+
+
+def read_frame(path, channels=None):
+    """Read point data from one ``.mc`` file of a cache.
+
+    Requires NumPy. Only the data for the requested channels is read; the
+    rest is seeked past. Arrays are read-only and big-endian, as they are
+    decoded without copying; use ``array.astype(numpy.float32)`` if you need
+    a native copy.
+
+    :param str path: The ``.mc`` file.
+    :param channels: The names of channels to read, or ``None`` for all.
+    :return: ``dict`` mapping channel names to ``(N, 3)`` arrays for vector
+        channels (``FVCA``/``DVCA``), or ``(N, )`` for scalar channels.
+    :raises ParseError: if a requested channel is missing.
+
+    """
+
+    wanted = None if channels is None else set(channels)
+
+    with open(path, 'rb') as fh:
+        parser = binary.Parser(fh, lazy=True)
+        parser.parse_all(skip_tags=('CACH', ))
+
+        channel_group = parser.find_one('MYCH', None)
+        if channel_group is None:
+            raise ParseError('no MYCH group in %r' % path)
+        res = _decode_channels(channel_group, wanted)
+
+    if wanted is not None:
+        missing = wanted.difference(res)
+        if missing:
+            raise ParseError('channels %s not in %r' % (', '.join(sorted(missing)), path))
+
+    return res
+
+
+# Maps OneFile .mc paths to (st_size, st_mtime, time_index).
+_time_index_cache = {}
+
+# Only headers are parsed when walking a OneFile .mc, so there is no point
+# buffering far past them.
+_header_block_size = 4096
+
+
+def build_time_index(path):
+    """Scan a OneFile ``.mc`` for the position of each time's ``MYCH`` group.
+
+    Only the header of each top-level group and its ``TIME`` chunk are read.
+
+    :param str path: The ``.mc`` file.
+    :return: ``dict`` mapping times (in ticks) to ``(offset, size)`` of the
+        contents of the ``MYCH`` group for that time.
+    :raises ParseError:
+
+    """
+
+    index = {}
+    with open(path, 'rb') as fh:
+        parser = binary.Parser(fh)
+        parser.block_size = _header_block_size
+        try:
+            while True:
+
+                group = parser.parse_next()
+                if group is None:
+                    break
+
+                if group.tag == 'MYCH':
+                    # The first chunk should be the TIME.
+                    parser.parse_next()
+                    time_chunk = group.children[0] if group.children else None
+                    if time_chunk is None or time_chunk.tag != 'TIME' or time_chunk.size != 4:
+                        raise ParseError('MYCH at %d without TIME in %r' % (group.start, path))
+                    # The contents start after the group type.
+                    index[time_chunk.ints[0]] = (group.start + 4, group.size - 4)
+
+                parser.skip_group(group)
+                parser.clear()
+
+        except (struct.error, AssertionError, ValueError) as e:
+            raise ParseError('could not parse %r near byte %d: %s' % (path, parser.tell(), e))
+
+    return index
+
+
+def get_time_index(path, cache=True):
+    """Get the time index of a OneFile ``.mc``; see :func:`build_time_index`.
+
+    The index is kept in memory and persisted in the user's cache directory,
+    and reused as long as the size and modification time of the file are
+    unchanged, so that random access to a multi-gigabyte cache doesn't
+    require reading through it every time.
+
+    :param str path: The ``.mc`` file.
+    :param bool cache: Use (and update) the cached index?
+
+    """
+
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+
+    if cache:
+        entry = _time_index_cache.get(path)
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime:
+            return entry[2]
+        raw = _load_json_cache('mcc-time-index', path, stat)
+        if raw is not None:
+            index = dict((time, (offset, size)) for time, offset, size in raw)
+            _time_index_cache[path] = (stat.st_size, stat.st_mtime, index)
+            return index
+
+    index = build_time_index(path)
+
+    if cache:
+        if len(_time_index_cache) >= channel_cache_size:
+            _time_index_cache.clear()
+        _time_index_cache[path] = (stat.st_size, stat.st_mtime, index)
+        _dump_json_cache('mcc-time-index', path, stat, sorted((t, o, s) for t, (o, s) in index.iteritems()))
+
+    return index
+
+
+def parse_time_group(file, entry):
+    """Parse the ``MYCH`` group of one time in a OneFile ``.mc``.
+
+    Chunks are parsed lazily, so only their headers are read until their
+    :attr:`~mayatools.binary.Chunk.data` is used; see :func:`iter_channels`.
+
+    :param file: The open ``.mc`` file, which must stay open while the data
+        of the chunks is used.
+    :param entry: The ``(offset, size)`` of the time from the time index;
+        see :func:`get_time_index`.
+    :return: The :class:`~mayatools.binary.Group`.
+    :raises ParseError:
+
+    """
+
+    offset, size = entry
+
+    # The index points at the contents; the group's header is before them.
+    file.seek(offset - 12)
+    parser = binary.Parser(file, lazy=True)
+    parser.block_size = _header_block_size
+    try:
+        group = parser.parse_next()
+        if group is None or group.tag != 'MYCH' or (group.start + 4, group.size - 4) != (offset, size):
+            raise ParseError('no MYCH group at %d in %r' % (offset, file.name))
+        while parser.tell() < group.end and parser.parse_next() is not None:
+            pass
+    except (struct.error, AssertionError, ValueError) as e:
+        raise ParseError('could not parse MYCH at %d in %r: %s' % (offset, file.name, e))
+
+    if parser.tell() > group.end:
+        raise ParseError('truncated %s chunk in MYCH at %d in %r' % (group.children[-1].tag, offset, file.name))
+
+    return group
+
+
+def read_time(path, time, channels=None, index=None):
+    """Read point data for one time from a OneFile ``.mc``.
+
+    With the time index (see :func:`get_time_index`) only the ``MYCH`` group
+    of the time is read. Arrays are decoded without copying, as in
+    :func:`read_frame`.
+
+    :param str path: The ``.mc`` file.
+    :param int time: The time in ticks.
+    :param channels: The names of channels to read, or ``None`` for all.
+    :param dict index: The time index; looked up if not given.
+    :return: ``dict`` mapping channel names to arrays; see :func:`read_frame`.
+    :raises KeyError: if the time is not in the file.
+    :raises ParseError: if a requested channel is missing.
+
+    """
+
+    if binary.np is None:
+        raise ImportError('NumPy is required for mcc.read_time')
+
+    index = get_time_index(path) if index is None else index
+    entry = index[int(time)]
+
+    wanted = None if channels is None else set(channels)
+    with open(path, 'rb') as fh:
+        res = _decode_channels(parse_time_group(fh, entry), wanted)
+
+    if wanted is not None:
+        missing = wanted.difference(res)
+        if missing:
+            raise ParseError('channels %s not at %d in %r' % (', '.join(sorted(missing)), time, path))
+
+    return res
+
+
+class Cache(object):
+
+    """A Maya geometry cache, as described by its XML file.
+
+    ::
+
+        >>> cache = Cache('/path/to/cache.xml')
+        >>> positions = cache.read_frame(250)['pSphereShape1']
+        >>> positions.shape
+        (482, 3)
+
+    """
+
+    def __init__(self, xml_path):
+
+        self.xml_path = os.path.abspath(xml_path)
+        self.directory = os.path.dirname(self.xml_path)
+        self.base_name = os.path.splitext(os.path.basename(self.xml_path))[0]
+
+        tree = etree.parse(self.xml_path)
+        self.cache_type = tree.find('cacheType').get('Type')
+        self.cache_format = tree.find('cacheType').get('Format')
+        self.time_per_frame = _parse_time_per_frame(tree)
+        self.start_time, self.end_time = _parse_time_range(tree)
+        self.channel_names = [element.get('ChannelName') for element in tree.find('Channels')]
+
+        # Frames may be sampled more (or less) often than once per frame.
+        sampling_rates = [int(element.get('SamplingRate')) for element in tree.find('Channels') if element.get('SamplingRate')]
+        self.sampling_rate = min(sampling_rates) if sampling_rates else self.time_per_frame
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.xml_path)
+
+    @property
+    def times(self):
+        """The times (in ticks) of each sample in the cache, every
+        :attr:`sampling_rate` ticks."""
+        return range(self.start_time, self.end_time + 1, self.sampling_rate)
+
+    @property
+    def frame_times(self):
+        """The times (in ticks) for which there is actually data in the cache,
+        from the time index of OneFile caches (see :func:`get_time_index`) or
+        the ``.mc`` files which exist (see :func:`get_frame_times`)."""
+        if self.cache_type == 'OneFile':
+            return sorted(get_time_index(self.get_frame_path(None)))
+        return get_frame_times(self.xml_path, self.time_per_frame)
+
+    @property
+    def channels(self):
+        """List of ``(name, size)`` tuples; see :func:`get_channels`."""
+        return get_channels(self.xml_path)
+
+    def get_frame_path(self, time):
+        """The ``.mc`` file for the given time; see :func:`get_frame_path`.
+
+        For OneFile caches this is the one ``.mc`` for all times.
+
+        """
+        if self.cache_type == 'OneFile':
+            return os.path.join(self.directory, self.base_name + '.mc')
+        return get_frame_path(self.xml_path, time, self.time_per_frame)
+
+    def read_frame(self, time, channels=None):
+        """Read point data for the given time; see :func:`read_frame`
+        and :func:`read_time`."""
+        if self.cache_type == 'OneFile':
+            return read_time(self.get_frame_path(time), time, channels)
+        if self.cache_type != 'OneFilePerFrame':
+            raise ValueError('cannot read frames from %r cache' % self.cache_type)
+        return read_frame(self.get_frame_path(time), channels)
+
+    def channel_view(self, channel, **kwargs):
+        """A lazy ``(frames, points, 3)`` view of one channel; see :class:`ChannelView`.
+
+        Views read ahead in a background thread and hold on to frames, so
+        :meth:`~ChannelView.close` them (or use them in a ``with`` block)
+        when done.
+
+        """
+        return ChannelView(self, channel, **kwargs)
+
+
+class ChannelView(object):
+
+    """A lazy, array-like view of one channel across all frames of a
+    :class:`Cache`.
+
+    Indexing behaves like a ``(frames, points, 3)`` NumPy array, but only
+    the requested frames are read, and only the one channel from each.
+    Frames are kept in a least-recently-used cache, and upcoming frames
+    are read in a background thread::
+
+        >>> with Cache('/path/to/cache.xml').channel_view('pSphereShape1') as view:
+        ...     view.shape
+        ...     view[10:20, 0] # Reads frames 10 through 19.
+        (100, 482, 3)
+
+    Call :meth:`close` when done with a view; a view which is dropped
+    without it stops its thread once it is garbage collected.
+
+    :param Cache cache: The cache to read from.
+    :param str channel: The name of the channel.
+    :param int cache_size: How many frames to keep in memory.
+    :param int prefetch: How many frames to read ahead; ``0`` disables the
+        background thread.
+
+    """
+
+    def __init__(self, cache, channel, cache_size=64, prefetch=4):
+
+        self.cache = cache
+        self.channel = channel
+        self.times = cache.times
+        self.cache_size = cache_size
+        self.prefetch = prefetch
+
+        # Maps frame indices to (last_use, array).
+        self._frames = {}
+        self._clock = itertools.count()
+        # Maps frame indices being read to an Event set when they are done.
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        self._queue = None
+        self._thread = None
+
+    def __repr__(self):
+        return '<%s %r of %r>' % (self.__class__.__name__, self.channel, self.cache.xml_path)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def shape(self):
+        return (len(self.times), ) + self.get_frame(0).shape
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        return self.get_frame(0).dtype
+
+    def close(self):
+        """Stop the prefetching thread and drop all cached frames."""
+        if self._thread is not None:
+            self._drain_queue()
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = self._queue = None
+        with self._lock:
+            self._frames.clear()
+
+    def get_frame(self, index):
+        """Get the array for one frame, and start reading the following frames."""
+        index = self._normalize_index(index)
+        self._schedule(range(index + 1, min(len(self.times), index + 1 + self.prefetch)))
+        return self._get(index)
+
+    def __getitem__(self, key):
+
+        if not isinstance(key, tuple):
+            key = (key, )
+        frame_key, rest = key[0], key[1:]
+
+        if isinstance(frame_key, slice):
+            indices = range(*frame_key.indices(len(self.times)))
+        elif hasattr(frame_key, '__index__'):
+            frame = self.get_frame(frame_key.__index__())
+            return frame[rest] if rest else frame
+        else:
+            indices = [self._normalize_index(i) for i in frame_key]
+
+        out = []
+        for i, index in enumerate(indices):
+            # Only read ahead within what was asked for.
+            self._schedule(indices[i + 1:i + 1 + self.prefetch])
+            frame = self._get(index)
+            out.append(frame[rest] if rest else frame)
+
+        if not out:
+            empty = binary.np.empty((0, ) + self.shape[1:], dtype=self.dtype)
+            return empty[(slice(None), ) + rest]
+        return binary.np.array(out)
+
+    def __array__(self, dtype=None):
+        array = self[:]
+        return array.astype(dtype) if dtype is not None else array
+
+    def _normalize_index(self, index):
+        if index < 0:
+            index += len(self.times)
+        if index < 0 or index >= len(self.times):
+            raise IndexError('frame index out of range')
+        return index
+
+    def _get(self, index):
+
+        while True:
+            with self._lock:
+                entry = self._frames.get(index)
+                if entry is not None:
+                    self._frames[index] = (next(self._clock), entry[1])
+                    return entry[1]
+                event = self._pending.get(index)
+                if event is None:
+                    event = self._pending[index] = threading.Event()
+                    break
+            # Another thread is reading it; if that fails, we will try ourselves.
+            event.wait()
+
+        try:
+            array = self.cache.read_frame(self.times[index], [self.channel])[self.channel]
+            with self._lock:
+                self._frames[index] = (next(self._clock), array)
+                # Evict the least recently used.
+                while len(self._frames) > self.cache_size:
+                    del self._frames[min(self._frames, key=lambda k: self._frames[k][0])]
+        finally:
+            with self._lock:
+                del self._pending[index]
+            event.set()
+
+        return array
+
+    def _drain_queue(self):
+        try:
+            while True:
+                self._queue.get_nowait()
+        except Queue.Empty:
+            pass
+
+    def _schedule(self, indices):
+
+        if not self.prefetch:
+            return
+        if self._thread is None:
+            self._queue = queue = Queue.Queue()
+            # The thread only has a weak reference to us, and is told to stop
+            # when we are collected, so views which aren't closed still die.
+            view_ref = weakref.ref(self, lambda ref: queue.put(None))
+            self._thread = threading.Thread(target=_prefetch_worker, args=(view_ref, queue))
+            self._thread.daemon = True
+            self._thread.start()
+
+        # Forget about earlier requests; we only read ahead of the latest.
+        self._drain_queue()
+        for index in indices:
+            if index not in self._frames and index not in self._pending:
+                self._queue.put(index)
 
+
+def _prefetch_worker(view_ref, queue):
+    while True:
+        index = queue.get()
+        view = view_ref()
+        if index is None or view is None:
+            return
+        try:
+            view._get(index)
+        except Exception:
+            # Errors are raised when the frame is actually requested.
+            pass
+        # Don't keep the view alive while waiting.
+        del view
+
+
+def _iter_channel_items(channels):
+    if isinstance(channels, dict):
+        return sorted(channels.iteritems())
+    return list(channels)
+
+
+def write_frame(path, time, channels, double=False):
+    """Write point data to one ``.mc`` file of a OneFilePerFrame cache.
+
+    Requires NumPy. Arrays already in big-endian order are written without
+    being copied.
+
+    :param str path: The ``.mc`` file to write.
+    :param int time: The time of the frame in ticks (e.g. ``250`` is frame 1).
+    :param channels: ``(name, array)`` pairs, or a ``dict`` (which is written
+        in sorted order); each array is ``(N, 3)`` positions.
+    :param bool double: Write ``DVCA`` (doubles) instead of ``FVCA`` (floats).
+
+    """
+
+    if binary.np is None:
+        raise ImportError('NumPy is required for mcc.write_frame')
+
+    tag, dtype = ('DVCA', '>f8') if double else ('FVCA', '>f4')
+
+    root = binary.Node()
+
+    header = root.add_group('CACH')
+    header.add_chunk('VRSN').string = '0.1'
+    header.add_chunk('STIM').ints = [int(time)]
+    header.add_chunk('ETIM').ints = [int(time)]
+
+    body = root.add_group('MYCH')
+    for name, points in _iter_channel_items(channels):
+        points = binary.np.ascontiguousarray(points, dtype=dtype).reshape(-1, 3)
+        body.add_chunk('CHNM').string = name
+        body.add_chunk('SIZE').ints = [len(points)]
+        body.add_chunk(tag, buffer(points))
+
+    with open(path, 'wb') as fh:
+        root.dump(fh)
+
+
+def write_xml(xml_path, channels, times, time_per_frame=250, double=False, extra=(), sampling_rate=None):
+    """Write the XML description of a OneFilePerFrame cache.
+
+    :param str xml_path: The XML file to write.
+    :param channels: The names of the channels, in order.
+    :param times: The times (in ticks) of every sample in the cache.
+    :param int time_per_frame: The length of a frame in ticks (i.e. the
+        ``cacheTimePerFrame``, which is ``250`` at 24fps).
+    :param bool double: If the channels are ``DVCA`` instead of ``FVCA``.
+    :param extra: Strings for ``<extra>`` elements (such as Maya adds to
+        describe the scene).
+    :param int sampling_rate: The interval between samples in ticks (i.e.
+        the channels' ``SamplingRate``); defaults to ``time_per_frame``. If
+        the times are not evenly spaced by this, channels are marked as
+        irregular.
+
+    """
+
+    if sampling_rate is None:
+        sampling_rate = time_per_frame
+
+    times = sorted(times)
+    start, end = times[0], times[-1]
+    regular = all(b - a == sampling_rate for a, b in zip(times, times[1:]))
+
+    root = etree.Element('Autodesk_Cache_File')
+    etree.SubElement(root, 'cacheType', Type='OneFilePerFrame', Format='mcc')
+    etree.SubElement(root, 'time', Range='%d-%d' % (start, end))
+    etree.SubElement(root, 'cacheTimePerFrame', TimePerFrame=str(time_per_frame))
+    etree.SubElement(root, 'cacheVersion', Version='2.0')
+    for text in extra:
+        etree.SubElement(root, 'extra').text = text
+
+    channels_element = etree.SubElement(root, 'Channels')
+    for i, name in enumerate(channels):
+        etree.SubElement(channels_element, 'channel%d' % i,
+            ChannelName=name,
+            ChannelType='DoubleVectorArray' if double else 'FloatVectorArray',
+            ChannelInterpretation='positions',
+            SamplingType='Regular' if regular else 'Irregular',
+            SamplingRate=str(sampling_rate),
+            StartTime=str(start),
+            EndTime=str(end),
+        )
+
+    with open(xml_path, 'w') as fh:
+        fh.write('<?xml version="1.0"?>\n')
+        fh.write(etree.tostring(root))
+        fh.write('\n')
+
+
+class CacheWriter(object):
+
+    """Writes a OneFilePerFrame cache one frame at a time, without Maya.
+
+    Frames are written as they are given, and the XML is written when the
+    writer is closed (which happens at the end of a ``with`` block, unless
+    there was an error)::
+
+        >>> with CacheWriter('/path/to/smoothed.xml') as writer:
+        ...     for time in cache.times:
+        ...         positions = cache.read_frame(time)['pSphereShape1']
+        ...         writer.write_frame(time, [('pSphereShape1', smooth(positions))])
+
+    :param str xml_path: The XML file to write; ``.mc`` files are written
+        next to it (see :func:`get_frame_path`).
+    :param int time_per_frame: The length of a frame in ticks.
+    :param bool double: Write ``DVCA`` (doubles) instead of ``FVCA`` (floats).
+    :param extra: Strings for ``<extra>`` elements in the XML.
+    :param int sampling_rate: The interval between samples in ticks;
+        defaults to ``time_per_frame``.
+
+    """
+
+    def __init__(self, xml_path, time_per_frame=250, double=False, extra=(), sampling_rate=None):
+        self.xml_path = os.path.abspath(xml_path)
+        self.time_per_frame = time_per_frame
+        self.sampling_rate = time_per_frame if sampling_rate is None else sampling_rate
+        self.double = double
+        self.extra = list(extra)
+        self.channel_names = None
+        self.times = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.close()
+
+    def write_frame(self, time, channels):
+        """Write the ``.mc`` file for one frame; see :func:`write_frame`.
+
+        Every frame must have the same channels, in the same order.
+
+        """
+        channels = _iter_channel_items(channels)
+        names = [name for name, points in channels]
+        if self.channel_names is None:
+            self.channel_names = names
+        elif names != self.channel_names:
+            raise ValueError('channels %r do not match %r' % (names, self.channel_names))
+        write_frame(get_frame_path(self.xml_path, time, self.time_per_frame), time, channels, self.double)
+        self.times.append(int(time))
+
+    def close(self):
+        """Write the XML file."""
+        if not self.times:
+            raise ValueError('no frames were written')
+        write_xml(self.xml_path, self.channel_names, self.times, self.time_per_frame, self.double, self.extra, self.sampling_rate)
+
+
+def get_frame_digest(path, ignore_tags=()):
+    """Get a digest of the content of a cache frame (see :meth:`.binary.Node.digest`).
+
+    :param str path: The ``.mc`` file.
+    :param ignore_tags: Tags to leave out of the digest, e.g. ``('STIM', 'ETIM')``
+        to match frames which only differ in time.
+
+    """
+    with open(path, 'rb') as fh:
+        parser = binary.Parser(fh, memory_map=True)
+        try:
+            parser.parse_all(skip_tags=frozenset(ignore_tags))
+            return parser.digest()
+        finally:
+            parser.close()
+
+
+def find_duplicate_frames(directory, ignore_tags=()):
+    """Find sets of ``.mc`` files in a directory with identical content.
+
+    :param str directory: The directory of caches to search.
+    :param ignore_tags: Passed to :func:`get_frame_digest`.
+    :return: Sorted lists of paths to identical frames, for each set of
+        two or more.
+
+    """
+
+    # Only files of the same size can possibly match.
+    by_size = {}
+    for name in os.listdir(directory):
+        if name.endswith('.mc'):
+            path = os.path.join(directory, name)
+            by_size.setdefault(os.path.getsize(path), []).append(path)
+
+    by_digest = {}
+    for size, paths in by_size.iteritems():
+        if len(paths) < 2:
+            continue
+        for path in paths:
+            by_digest.setdefault((size, get_frame_digest(path, ignore_tags)), []).append(path)
+
+    return sorted(sorted(paths) for paths in by_digest.itervalues() if len(paths) > 1)
+
+
+def link_duplicate_frames(directory, dry_run=False):
+    """Replace identical ``.mc`` files in a directory with hardlinks to one copy.
+
+    Files are only linked if they are byte-for-byte identical, which in
+    practice means copies of the same frame (e.g. in versions of a cache).
+    Frames which hold still over time are never linked, as each records
+    its own time in ``STIM``/``ETIM`` and a hardlink can only have one;
+    use :func:`find_duplicate_frames` with ``ignore_tags=('STIM', 'ETIM')``
+    to find those.
+
+    :param str directory: The directory of caches to deduplicate.
+    :param bool dry_run: Only determine what would be linked.
+    :return: List of ``(original_path, linked_path)`` tuples.
+
+    """
+    linked = []
+    for paths in find_duplicate_frames(directory):
+        original = paths[0]
+        for path in paths[1:]:
+            if os.path.samefile(original, path):
+                continue
+            if not filecmp.cmp(original, path, shallow=False):
+                continue
+            linked.append((original, path))
+            if dry_run:
+                continue
+            # Link beside the file and rename over it, so that the frame is
+            # never missing.
+            tmp_path = '%s.%d.tmp' % (path, os.getpid())
+            os.link(original, tmp_path)
+            os.rename(tmp_path, path)
+    return linked
+
+
+if __name__ == '__main__':
+
+    from optparse import OptionParser
+
+    opt_parser = OptionParser(usage='%prog [options] directory [...]')
+    opt_parser.add_option('-l', '--link', action='store_true',
+        help='replace byte-identical frames with hardlinks (never held frames)')
+    opt_parser.add_option('-n', '--dry-run', action='store_true')
+    opt_parser.add_option('-t', '--ignore-times', action='store_true',
+        help='also report frames which only differ in STIM/ETIM')
+    opts, args = opt_parser.parse_args()
+
+    for directory in args:
+        if opts.link:
+            for original, path in link_duplicate_frames(directory, dry_run=opts.dry_run):
+                print '%s -> %s' % (path, original)
+        else:
+            ignore_tags = ('STIM', 'ETIM') if opts.ignore_times else ()
+            for paths in find_duplicate_frames(directory, ignore_tags):
+                print ' '.join(os.path.basename(path) for path in paths)
@@ -0,0 +1,21 @@
+import functools
+
+try:
+    from unittest import SkipTest
+except ImportError:
+    # Python 2.6 only skips under nose.
+    from nose.exc import SkipTest
+
+from mayatools import binary
+
+
+def requires_numpy(func):
+    """Skip (visibly) the decorated test if NumPy is not installed."""
+
+    if binary.np is not None:
+        return func
+
+    @functools.wraps(func)
+    def _skipper(*args, **kwargs):
+        raise SkipTest('NumPy is not installed')
+    return _skipper
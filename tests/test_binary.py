@@ -0,0 +1,481 @@
+import array
+import contextlib
+import os
+import shutil
+import struct
+import tempfile
+from unittest import TestCase
+
+from mayatools import binary
+
+from helpers import requires_numpy
+
+
+def make_frame(start=250, end=250, channels=(('fluidShape1_density', [1000.0, 1100.0, 1200.0]), )):
+    root = binary.Node()
+    header = root.add_group('CACH')
+    header.add_chunk('VRSN').string = '0.1'
+    header.add_chunk('STIM').ints = [start]
+    header.add_chunk('ETIM').ints = [end]
+    body = root.add_group('MYCH')
+    for name, data in channels:
+        body.add_chunk('CHNM').string = name
+        body.add_chunk('SIZE').ints = [len(data)]
+        body.add_chunk('FBCA').floats = data
+    return root
+
+
+class BinaryTestCase(TestCase):
+
+    def setUp(self):
+        self.sandbox = tempfile.mkdtemp()
+        # Keep cached tables of contents out of the real cache.
+        self._cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.sandbox, 'cache')
+
+    def tearDown(self):
+        if self._cache_home is None:
+            os.environ.pop('XDG_CACHE_HOME')
+        else:
+            os.environ['XDG_CACHE_HOME'] = self._cache_home
+        shutil.rmtree(self.sandbox)
+
+    def write(self, node, name='frame.mc'):
+        path = os.path.join(self.sandbox, name)
+        with open(path, 'wb') as fh:
+            node.dump(fh)
+        return path
+
+
+class TestParser(BinaryTestCase):
+
+    def test_roundtrip(self):
+        path = self.write(make_frame())
+        parser = binary.Parser(open(path, 'rb'))
+        parser.parse_all()
+        self.assertEqual(parser.find_one('CHNM').string, 'fluidShape1_density')
+        self.assertEqual(list(parser.find_one('FBCA').floats), [1000.0, 1100.0, 1200.0])
+        self.assertEqual(''.join(parser.dumps_iter()), open(path, 'rb').read())
+
+    def test_nested_dump(self):
+        root = binary.Node()
+        outer = root.add_group('OUTR')
+        outer.add_chunk('CHNM').string = 'odd'
+        inner = outer.add_group('INNR')
+        inner.add_chunk('FBCA').floats = [1.0, 2.0]
+        self.assertEqual(root.nbytes, len(''.join(root.dumps_iter())))
+        path = self.write(root)
+        parser = binary.Parser(open(path, 'rb'))
+        parser.parse_all()
+        self.assertEqual(parser.find_one('INNR').size, 4 + 16)
+        self.assertEqual(parser.find_one('OUTR').size, 4 + 12 + 28)
+        self.assertEqual(''.join(parser.dumps_iter()), open(path, 'rb').read())
+
+    def test_index(self):
+        frame = make_frame(channels=[('a', [1.0]), ('b', [2.0]), ('c', [3.0])])
+        path = self.write(frame)
+        plain = binary.Parser(open(path, 'rb'))
+        plain.parse_all()
+        indexed = binary.Parser(open(path, 'rb'), index=True)
+        indexed.parse_all()
+        self.assertTrue(indexed._index is not None)
+        for tag in ('CACH', 'MYCH', 'CHNM', 'FBCA', 'STIM', 'NONE'):
+            key = lambda n: (n.tag, n.start if isinstance(n, binary.Group) else n.offset)
+            self.assertEqual(map(key, plain.find(tag)), map(key, indexed.find(tag)))
+        mych = indexed.find_one('MYCH')
+        self.assertEqual([c.string for c in mych.find('CHNM')], ['a', 'b', 'c'])
+        self.assertEqual(list(mych.find('STIM')), [])
+        self.assertRaises(KeyError, mych.find_one, 'STIM')
+
+        # Modifying the graph drops the index.
+        mych.add_chunk('CHNM').string = 'd'
+        self.assertTrue(mych._index is None)
+        self.assertTrue(indexed._index is None)
+        self.assertEqual([c.string for c in indexed.find('CHNM')], ['a', 'b', 'c', 'd'])
+        indexed.build_index()
+        self.assertEqual([c.string for c in indexed.find('CHNM')], ['a', 'b', 'c', 'd'])
+
+    def test_filters(self):
+        frame = make_frame(channels=[('a', [1.0]), ('b', [2.0, 3.0])])
+        path = self.write(frame)
+        for kwargs in ({}, {'lazy': True}, {'memory_map': True}):
+            parser = binary.Parser(open(path, 'rb'), **kwargs)
+            parser.parse_all(include_tags=('CHNM', 'SIZE'), skip_tags=('CACH', ))
+            self.assertEqual([g.tag for g in parser.children], ['MYCH'])
+            self.assertEqual([c.tag for c in parser.children[0].children], ['CHNM', 'SIZE', 'CHNM', 'SIZE'])
+            self.assertEqual([c.string for c in parser.find('CHNM')], ['a', 'b'])
+            self.assertEqual([c.ints[0] for c in parser.find('SIZE')], [1, 2])
+
+    def test_max_depth(self):
+        root = binary.Node()
+        outer = root.add_group('OUTR')
+        outer.add_chunk('CHNM').string = 'outer'
+        inner = outer.add_group('INNR')
+        inner.add_chunk('CHNM').string = 'inner'
+        outer.add_chunk('CHNM').string = 'after'
+        path = self.write(root)
+        parser = binary.Parser(open(path, 'rb'))
+        parser.parse_all(max_depth=1)
+        self.assertEqual([c.string for c in parser.find('CHNM')], ['outer', 'after'])
+        self.assertEqual(list(parser.find('INNR')), [])
+
+    def test_iterparse(self):
+        root = binary.Node()
+        outer = root.add_group('OUTR')
+        outer.add_chunk('CHNM').string = 'outer'
+        inner = outer.add_group('INNR')
+        inner.add_chunk('CHNM').string = 'inner'
+        root.add_group('LAST').add_chunk('SIZE').ints = [1]
+        path = self.write(root)
+        parser = binary.Parser(open(path, 'rb'))
+        events = [(event, node.tag) for event, node in parser.iterparse()]
+        self.assertEqual(events, [
+            ('start', 'OUTR'),
+            ('chunk', 'CHNM'),
+            ('start', 'INNR'),
+            ('chunk', 'CHNM'),
+            ('end', 'INNR'),
+            ('end', 'OUTR'),
+            ('start', 'LAST'),
+            ('chunk', 'SIZE'),
+            ('end', 'LAST'),
+        ])
+
+    def test_skip_group(self):
+        path = self.write(make_frame(channels=[('a', [1.0]), ('b', [2.0])]))
+        parser = binary.Parser(open(path, 'rb'))
+        first_chunks = []
+        while True:
+            group = parser.parse_next()
+            if group is None:
+                break
+            first_chunks.append(parser.parse_next().tag)
+            parser.skip_group(group)
+            self.assertEqual(parser.tell(), group.end)
+        self.assertEqual(first_chunks, ['VRSN', 'CHNM'])
+        self.assertEqual([len(g.children) for g in parser.children], [1, 1])
+
+    def test_iterparse_clear(self):
+        path = self.write(make_frame(channels=[('a', [1.0]), ('b', [2.0])]))
+        parser = binary.Parser(open(path, 'rb'))
+        names = []
+        for event, node in parser.iterparse(events=('chunk', 'end')):
+            if event == 'chunk' and node.tag == 'CHNM':
+                names.append(node.string)
+            elif event == 'end':
+                node.clear()
+        self.assertEqual(names, ['a', 'b'])
+        self.assertEqual([len(g.children) for g in parser.children], [0, 0])
+
+    def test_iterparse_clear_index(self):
+        root = binary.Node()
+        outer = root.add_group('OUTR')
+        outer.add_chunk('CHNM').string = 'outer'
+        inner = outer.add_group('INNR')
+        inner.add_chunk('CHNM').string = 'x'
+        inner.add_chunk('CHNM').string = 'y'
+        path = self.write(root)
+        parser = binary.Parser(open(path, 'rb'), index=True)
+        for event, node in parser.iterparse():
+            if event == 'chunk' and node.string == 'x':
+                node.parent.parent.clear()
+                inner = node.parent
+        self.assertEqual([c.string for c in inner.children], ['x', 'y'])
+        self.assertEqual([c.string for c in inner.find('CHNM')], ['x', 'y'])
+
+    def test_block_sizes(self):
+        frame = make_frame(channels=[('a', [1.0] * 100), ('bb', [2.0] * 3), ('ccc', [])])
+        path = self.write(frame)
+        expected = open(path, 'rb').read()
+        for block_size in (1, 3, 7, 64, 1024):
+            for lazy in (False, True):
+                parser = binary.Parser(open(path, 'rb'), lazy=lazy)
+                parser.block_size = block_size
+                parser.parse_all()
+                self.assertEqual(''.join(parser.dumps_iter()), expected)
+                self.assertEqual([c.string for c in parser.find('CHNM')], ['a', 'bb', 'ccc'])
+                parser = binary.Parser(open(path, 'rb'))
+                parser.block_size = block_size
+                parser.parse_all(include_tags=('SIZE', ))
+                self.assertEqual([c.ints[0] for c in parser.find('SIZE')], [100, 3, 0])
+
+    def test_memory_map(self):
+        path = self.write(make_frame())
+        parser = binary.Parser(open(path, 'rb'), memory_map=True)
+        parser.parse_all()
+        chunk = parser.find_one('FBCA')
+        self.assertTrue(isinstance(chunk.data, buffer))
+        self.assertEqual(list(chunk.floats), [1000.0, 1100.0, 1200.0])
+        self.assertEqual(parser.find_one('CHNM').string, 'fluidShape1_density')
+        self.assertEqual(''.join(str(x) for x in parser.dumps_iter()), open(path, 'rb').read())
+        parser.close()
+
+    def test_memory_map_empty(self):
+        path = os.path.join(self.sandbox, 'empty.mc')
+        open(path, 'wb').close()
+        parser = binary.Parser(open(path, 'rb'), memory_map=True)
+        parser.parse_all()
+        self.assertEqual(parser.children, [])
+
+    def test_lazy(self):
+        path = self.write(make_frame())
+        parser = binary.Parser(open(path, 'rb'), lazy=True)
+        parser.parse_all()
+        chunk = parser.find_one('FBCA')
+        self.assertTrue(chunk._data is None)
+        self.assertEqual(chunk.size, 12)
+        self.assertEqual(list(chunk.floats), [1000.0, 1100.0, 1200.0])
+        chunk.release()
+        self.assertTrue(chunk._data is None)
+        self.assertEqual(''.join(parser.dumps_iter()), open(path, 'rb').read())
+
+    def test_lazy_during_parse(self):
+        path = self.write(make_frame(start=123))
+        parser = binary.Parser(open(path, 'rb'), lazy=True)
+        while True:
+            node = parser.parse_next()
+            if node.tag == 'STIM':
+                break
+        self.assertEqual(node.ints[0], 123)
+        self.assertEqual(parser.parse_next().tag, 'ETIM')
+
+
+class TestChunk(TestCase):
+
+    def test_ints(self):
+        chunk = binary.Chunk('SIZE')
+        chunk.ints = [1, 2, 0xfffffffe]
+        self.assertEqual(chunk.data, '\x00\x00\x00\x01\x00\x00\x00\x02\xff\xff\xff\xfe')
+        self.assertEqual(list(chunk.ints), [1, 2, 0xfffffffe])
+
+    def test_floats(self):
+        chunk = binary.Chunk('FBCA')
+        chunk.floats = [1.0, -2.5]
+        self.assertEqual(chunk.data, '\x3f\x80\x00\x00\xc0\x20\x00\x00')
+        self.assertEqual(list(chunk.floats), [1.0, -2.5])
+
+    def test_bad_size(self):
+        chunk = binary.Chunk('FBCA', 'abcde')
+        self.assertRaises(ValueError, lambda: chunk.floats)
+
+    @requires_numpy
+    def test_as_array(self):
+        np = binary.np
+        chunk = binary.Chunk('FBCA')
+        chunk.floats = np.arange(6, dtype='float32')
+        self.assertEqual(list(chunk.floats), [0.0, 1.0, 2.0, 3.0, 4.0, 5.0])
+        self.assertEqual(chunk.as_array('>f4').reshape(-1, 3).tolist(), [[0, 1, 2], [3, 4, 5]])
+
+
+class TestTableOfContents(BinaryTestCase):
+
+    def test_from_toc(self):
+        path = self.write(make_frame(channels=[('a', [1.0]), ('bb', [2.0, 3.0])]))
+        toc = binary.get_toc(path)
+        self.assertEqual(len(toc), 11)
+        self.assertTrue(os.path.exists(binary.get_toc_cache_path(path)))
+
+        parser = binary.Parser.from_toc(open(path, 'rb'), index=True)
+        self.assertEqual([c.string for c in parser.find('CHNM')], ['a', 'bb'])
+        self.assertEqual(list(parser.find_one('FBCA').floats), [1.0])
+        self.assertEqual(''.join(parser.dumps_iter()), open(path, 'rb').read())
+        self.assertTrue(parser.parse_next() is None)
+
+    def test_cache(self):
+        path = self.write(make_frame())
+        toc = binary.get_toc(path, sidecar=True)
+        cached = binary.get_toc(path, sidecar=True)
+        self.assertTrue(toc is not cached)
+        for name in binary.TableOfContents._columns:
+            self.assertEqual(getattr(toc, name), getattr(cached, name))
+        self.assertEqual(toc.tag_names, cached.tag_names)
+
+        # Changing the file invalidates the cache.
+        self.write(make_frame(channels=[('a', [1.0]), ('b', [2.0])]))
+        os.utime(path, (0, 0))
+        changed = binary.get_toc(path, sidecar=True)
+        self.assertEqual((len(toc), len(changed)), (8, 11))
+
+    def test_root(self):
+        path = self.write(make_frame(channels=[('a', [1.0]), ('bb', [2.0, 3.0])]))
+        toc = binary.get_toc(path, cache=False)
+        root = toc.root(open(path, 'rb'))
+        self.assertEqual([(c.tag, c.type) for c in root.children], [('CACH', 'FOR4'), ('MYCH', 'FOR4')])
+        self.assertEqual((root.tag, root.type, root.size, root.offset, root.parent), (None, None, None, None, None))
+        mych = root.find_one('MYCH')
+        self.assertEqual(mych.parent, root)
+        self.assertEqual([c.tag for c in mych.children], ['CHNM', 'SIZE', 'FBCA'] * 2)
+        self.assertEqual([c.string for c in mych.find('CHNM')], ['a', 'bb'])
+        self.assertEqual(list(root.find_one('FBCA').floats), [1.0])
+        self.assertEqual(root.find_one('STIM').ints[0], 250)
+        self.assertEqual(list(mych.find('STIM')), [])
+        self.assertRaises(KeyError, mych.find_one, 'NONE')
+
+
+class TestFiles(BinaryTestCase):
+
+    def test_arrays(self):
+        path = os.path.join(self.sandbox, 'arrays')
+        self.assertTrue(binary.atomic_write(path, lambda fh: binary.dump_arrays(fh, [array.array('i', [1, -2]), array.array('d', [0.5])])))
+        self.assertEqual(os.listdir(self.sandbox), ['arrays'])
+        self.assertEqual(open(path, 'rb').read(8), '\x00\x00\x00\x01\xff\xff\xff\xfe')
+        ints, doubles = array.array('i'), array.array('d')
+        binary.load_arrays(open(path, 'rb'), [ints, doubles], [2, 1])
+        self.assertEqual((ints.tolist(), doubles.tolist()), ([1, -2], [0.5]))
+        self.assertRaises(ValueError, binary.load_arrays, open(path, 'rb'), [ints, doubles], [2, 2])
+
+    def test_atomic_write_failure(self):
+        path = os.path.join(self.write(make_frame()), 'nested')
+        self.assertFalse(binary.atomic_write(path, lambda fh: fh.write('x')))
+
+
+class TestSlots(TestCase):
+
+    def test_no_dict(self):
+        self.assertFalse(hasattr(binary.Chunk('TEST'), '__dict__'))
+        self.assertFalse(hasattr(binary.Group('TEST'), '__dict__'))
+
+
+class TestScan(BinaryTestCase):
+
+    def test_scan_many(self):
+        paths = [
+            self.write(make_frame(start=250 * i, end=250 * i, channels=[('a', [1.0]), ('b', [2.0])]), 'frame%d.mc' % i)
+            for i in xrange(1, 6)
+        ]
+        for workers in (1, 2):
+            results = binary.scan_many(paths, tags=('STIM', 'CHNM'), workers=workers)
+            self.assertEqual(results, [
+                {'STIM': [(250 * i, )], 'CHNM': ['a', 'b']}
+                for i in xrange(1, 6)
+            ])
+
+
+class TestHexdump(TestCase):
+
+    def test_raw(self):
+        raw = 'FOR4\x00\x00\x00\x28CACHVRSN\x00\x00\x00\x04'
+        self.assertEqual(binary.hexdump(raw, 0x10, indent='  '),
+            '  0010: 464f5234 00000028 43414348 5652534e FOR4...(CACHVRSN\n'
+            '  0020: 00000004                            ....\n'
+        )
+
+    def test_blocks(self):
+        raw = ''.join(map(chr, xrange(256))) * 3
+        lines = list(binary._hexdump_raw(raw, 0, 4, 16, '', block_lines=5))
+        self.assertEqual(len(lines), 10)
+        self.assertEqual(''.join(lines), binary.hexdump(buffer(raw)))
+        self.assertEqual(''.join(lines).count('\n'), 48)
+
+    def test_typed(self):
+        self.assertEqual(binary.hexdump('\x00\x00\x00\xfa', tag='STIM'),
+            '0000: 000000fa                            250\n'
+        )
+
+
+class TestPatch(BinaryTestCase):
+
+    def shift(self, path, **kwargs):
+        shift = lambda chunk: struct.pack('>L', chunk.ints[0] + 250)
+        return binary.patch(path, {'STIM': shift, 'ETIM': shift}, **kwargs)
+
+    def test_patch(self):
+        path = self.write(make_frame(start=250, end=500))
+        self.assertEqual(self.shift(path), 2)
+        self.assertEqual(binary.scan(path, ('STIM', 'ETIM')), {'STIM': [(500, )], 'ETIM': [(750, )]})
+        self.assertEqual(open(path, 'rb').read(), ''.join(make_frame(start=500, end=750).dumps_iter()))
+
+    def test_patch_toc(self):
+        path = self.write(make_frame(start=250, end=500))
+        toc = binary.get_toc(path, cache=False)
+        self.assertEqual(self.shift(path, toc=toc), 2)
+        self.assertEqual(binary.scan(path, ('STIM', 'ETIM')), {'STIM': [(500, )], 'ETIM': [(750, )]})
+        self.assertEqual(toc.st_mtime, os.stat(path).st_mtime)
+        # The patched table is cached, so it is not rescanned.
+        original_scan = binary.TableOfContents.scan
+        binary.TableOfContents.scan = None
+        try:
+            self.assertEqual(len(binary.get_toc(path)), len(toc))
+        finally:
+            binary.TableOfContents.scan = original_scan
+
+    def test_stale_toc(self):
+        path = self.write(make_frame(start=250, end=500))
+        toc = binary.get_toc(path, cache=False)
+        frame = make_frame(start=250, end=500)
+        frame.find_one('VRSN').string = '0.1.2.3'
+        self.write(frame)
+        self.assertEqual(self.shift(path, toc=toc), 2)
+        self.assertEqual(binary.scan(path, ('STIM', 'ETIM', 'VRSN')), {'STIM': [(500, )], 'ETIM': [(750, )], 'VRSN': ['0.1.2.3']})
+
+    def test_moved_chunk(self):
+        path = self.write(make_frame(start=250, end=500))
+        toc = binary.get_toc(path, cache=False)
+        frame = make_frame(start=250, end=500)
+        frame.find_one('VRSN').string = '0.1.2.3'
+        self.write(frame)
+        # Pretend the timestamps didn't change.
+        stat = os.stat(path)
+        toc.st_size, toc.st_mtime = stat.st_size, stat.st_mtime
+        original = open(path, 'rb').read()
+        self.assertRaises(ValueError, self.shift, path, toc=toc)
+        self.assertEqual(open(path, 'rb').read(), original)
+
+    def test_size_mismatch(self):
+        path = self.write(make_frame())
+        original = open(path, 'rb').read()
+        self.assertRaises(ValueError, binary.patch, path, {'STIM': '\0\0\0\1', 'CHNM': 'short\0'})
+        self.assertEqual(open(path, 'rb').read(), original)
+
+
+class ForwardOnly(object):
+
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+
+    def read(self, size):
+        data = self._data[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+
+class TestCompressed(BinaryTestCase):
+
+    def test_forward_only(self):
+        frame = make_frame(channels=[('a', [1.0] * 100), ('b', [2.0])])
+        raw = ''.join(frame.dumps_iter())
+        for block_size in (5, 64 * 1024):
+            parser = binary.Parser(ForwardOnly(raw), lazy=True)
+            parser.block_size = block_size
+            parser.parse_all()
+            self.assertEqual(''.join(parser.dumps_iter()), raw)
+            parser = binary.Parser(ForwardOnly(raw))
+            parser.block_size = block_size
+            parser.parse_all(include_tags=('CHNM', ), skip_tags=('CACH', ))
+            self.assertEqual([c.string for c in parser.find('CHNM')], ['a', 'b'])
+        self.assertRaises(ValueError, binary.Parser, ForwardOnly(raw), memory_map=True)
+
+    def test_gzip(self):
+        frame = make_frame(channels=[('a', [1.0] * 100)])
+        path = os.path.join(self.sandbox, 'frame.mc.gz')
+        with contextlib.closing(binary.open_file(path, 'wb')) as fh:
+            frame.dump(fh)
+        self.assertEqual(open(path, 'rb').read(2), '\x1f\x8b')
+        with contextlib.closing(binary.open_file(path)) as fh:
+            parser = binary.Parser(fh, lazy=True)
+            parser.parse_all()
+            self.assertEqual(''.join(parser.dumps_iter()), ''.join(frame.dumps_iter()))
+        self.assertEqual(binary.scan(path, ('CHNM', )), {'CHNM': ['a']})
+
+
+class TestDigest(TestCase):
+
+    def test_digest(self):
+        a = make_frame(channels=[('a', [1.0])])
+        b = make_frame(channels=[('a', [1.0])])
+        c = make_frame(channels=[('a', [2.0])])
+        self.assertEqual(a.digest(), b.digest())
+        self.assertNotEqual(a.digest(), c.digest())
+        self.assertEqual(a.find_one('CHNM').digest(), c.find_one('CHNM').digest())
+        self.assertNotEqual(a.find_one('FBCA').digest(), c.find_one('FBCA').digest())
@@ -0,0 +1,174 @@
+import os
+
+from test_mcc import MCCTestCase, make_one_file
+
+from mayatools import binary
+from mayatools import mcc
+from mayatools.geocache import bounds
+from mayatools.geocache import retime
+from mayatools.geocache import validate
+
+from helpers import requires_numpy
+
+
+class TestValidate(MCCTestCase):
+
+    def setUp(self):
+        super(TestValidate, self).setUp()
+        self.xml_path = self.write_xml('cache.xml', 250, 1000, ['a', 'b'])
+        for frame in xrange(1, 5):
+            self.write_frame('cacheFrame%d.mc' % frame, frame * 250, [
+                ('a', [(0, 0, 0)] * 3),
+                ('b', [(1, 1, 1)]),
+            ])
+
+    def assertErrors(self, expected):
+        report = validate.validate(self.xml_path, workers=2)
+        errors = sorted((e['kind'], e.get('time'), e.get('channel')) for e in report['errors'])
+        self.assertEqual(errors, sorted(expected))
+        self.assertEqual(report['ok'], not expected)
+        return report
+
+    def test_ok(self):
+        report = self.assertErrors([])
+        self.assertEqual(report['frames_checked'], 4)
+        self.assertEqual(report['channels'], {
+            'a': {'size': 3, 'type': 'FVCA'},
+            'b': {'size': 1, 'type': 'FVCA'},
+        })
+
+    def test_missing_frame(self):
+        os.unlink(os.path.join(self.sandbox, 'cacheFrame3.mc'))
+        self.assertErrors([('missing', 750, None)])
+
+    def test_truncated(self):
+        path = os.path.join(self.sandbox, 'cacheFrame2.mc')
+        data = open(path, 'rb').read()
+        with open(path, 'wb') as fh:
+            fh.write(data[:-10])
+        self.assertErrors([('truncated', 500, None)])
+        open(path, 'wb').close()
+        self.assertErrors([('truncated', 500, None)])
+
+    def test_channels(self):
+        self.write_frame('cacheFrame2.mc', 500, [('a', [(0, 0, 0)] * 4), ('c', [(0, 0, 0)])])
+        self.write_frame('cacheFrame3.mc', 250, [('a', [(0, 0, 0)] * 3), ('b', [(1, 1, 1)])])
+        self.assertErrors([
+            ('point_count', 500, 'a'),
+            ('channels', 500, 'b'),
+            ('channels', 500, 'c'),
+            ('time', 750, None),
+            ('time', 750, None),
+        ])
+
+    def test_unexpected_frame(self):
+        self.write_frame('cacheFrame5.mc', 1250, [('a', [(0, 0, 0)] * 3), ('b', [(1, 1, 1)])])
+        self.assertErrors([('unexpected_frame', None, None)])
+
+    def test_sub_frames(self):
+        self.xml_path = self.write_xml('sub.xml', 250, 500, ['a'], sampling_rate=125)
+        self.write_frame('subFrame1.mc', 250, [('a', [(0, 0, 0)])])
+        self.write_frame('subFrame1Tick125.mc', 375, [('a', [(0, 0, 0)])])
+        report = self.assertErrors([('missing', 500, None)])
+        self.assertEqual(report['frames_checked'], 3)
+        self.assertEqual((report['time_per_frame'], report['sampling_rate']), (250, 125))
+
+    def test_30fps(self):
+        self.xml_path = self.write_xml('fast.xml', 200, 400, ['a'], time_per_frame=200)
+        for frame in (1, 2):
+            self.write_frame('fastFrame%d.mc' % frame, frame * 200, [('a', [(0, 0, 0)])])
+        self.assertEqual(self.assertErrors([])['frames_checked'], 2)
+
+    def test_one_file(self):
+        self.xml_path = self.write_xml('single.xml', 250, 750, ['a'], cache_type='OneFile')
+        with open(os.path.join(self.sandbox, 'single.mc'), 'wb') as fh:
+            make_one_file([250, 500], [('a', [(0, 0, 0)])]).dump(fh)
+        self.assertErrors([('missing', 750, None)])
+
+
+class TestRetime(MCCTestCase):
+
+    def setUp(self):
+        super(TestRetime, self).setUp()
+        self.xml_path = self.write_xml('src.xml', 250, 1000, ['a'])
+        for frame in xrange(1, 5):
+            self.write_frame('srcFrame%d.mc' % frame, frame * 250, [('a', [(frame, frame * frame, 0)] * 2)])
+
+    def test_weights(self):
+        times = [250, 500, 750, 1000]
+        self.assertEqual(retime.get_weights(times, 500), [(500, 1.0)])
+        self.assertEqual(retime.get_weights(times, 625), [(500, 0.5), (750, 0.5)])
+        weights = retime.get_weights(times, 625, cubic=True)
+        self.assertEqual([t for t, w in weights], times)
+        self.assertAlmostEqual(sum(w for t, w in weights), 1.0)
+        self.assertEqual([t for t, w in retime.get_weights(times, 300, cubic=True)], [250, 500, 750])
+        self.assertRaises(ValueError, retime.get_weights, times, 1001)
+
+    @requires_numpy
+    def test_linear(self):
+        dst_path = os.path.join(self.sandbox, 'out', 'dst.xml')
+        paths = retime.schedule_retime(self.xml_path, dst_path, src_start=1, src_end=4, dst_start=1, dst_end=7, sampling_rate=1, workers=1)
+        self.assertEqual(len(paths), 7)
+        cache = mcc.Cache(dst_path)
+        self.assertEqual((cache.time_per_frame, cache.sampling_rate), (250, 250))
+        self.assertEqual(cache.times, range(250, 1751, 250))
+        self.assertEqual(cache.read_frame(500)['a'].tolist(), [[1.5, 2.5, 0]] * 2)
+        self.assertEqual(cache.read_frame(1750)['a'].tolist(), [[4, 16, 0]] * 2)
+
+    @requires_numpy
+    def test_cubic(self):
+        dst_path = os.path.join(self.sandbox, 'dst.xml')
+        retime.schedule_retime(self.xml_path, dst_path, src_start=1, src_end=4, dst_start=1, dst_end=4, sampling_rate=0.5, workers=2, cubic=True)
+        cache = mcc.Cache(dst_path)
+        self.assertEqual((cache.time_per_frame, cache.sampling_rate), (250, 125))
+        self.assertEqual(cache.times, range(250, 1001, 125))
+        self.assertEqual(os.path.basename(cache.get_frame_path(375)), 'dstFrame1Tick125.mc')
+        self.assertEqual(cache.read_frame(250)['a'].tolist(), [[1, 1, 0]] * 2)
+        # Catmull-Rom is exact for quadratics away from the ends.
+        self.assertEqual(cache.read_frame(625)['a'].tolist(), [[2.5, 6.25, 0]] * 2)
+
+
+class TestBounds(MCCTestCase):
+
+    def setUp(self):
+        super(TestBounds, self).setUp()
+        self.xml_path = self.write_xml('cache.xml', 250, 750, ['a', 'b'])
+        for frame in xrange(1, 4):
+            self.write_frame('cacheFrame%d.mc' % frame, frame * 250, [
+                ('a', [(0, 0, 0), (frame, -frame, 1)]),
+                ('b', [(10, 10, 10)] * frame),
+            ])
+
+    @requires_numpy
+    def test_compute(self):
+        index = bounds.BoundsIndex.compute(self.xml_path)
+        self.assertEqual(list(index.times), [250, 500, 750])
+        self.assertEqual(index.get_bounds('a', 500), ((0, -2, 0), (2, 0, 1)))
+        self.assertEqual(index.get_bounds('b', 750), ((10, 10, 10), (10, 10, 10)))
+        self.assertAlmostEqual(index.get_displacement('a', 750)[1], 8 ** 0.5, 5)
+        self.assertEqual(index.get_displacement('a', 750)[0], 0)
+        # The point count of b changes, so it has no displacement.
+        self.assertTrue(all(x != x for x in index.get_displacement('b', 500)))
+        self.assertEqual(index.get_displacement('b', 250), (0, 0))
+        self.assertEqual(index.get_union_bounds(), ((0, -3, 0), (10, 10, 10)))
+        self.assertEqual(index.get_union_bounds(['a'], end=500), ((0, -2, 0), (2, 0, 1)))
+        self.assertAlmostEqual(index.get_max_displacement('a'), 8 ** 0.5, 5)
+        self.assertRaises(KeyError, index.get_bounds, 'c', 250)
+        self.assertRaises(KeyError, index.get_bounds, 'a', 1000)
+
+    @requires_numpy
+    def test_sidecar(self):
+        index = bounds.get_bounds(self.xml_path)
+        self.assertTrue(os.path.exists(os.path.join(self.sandbox, 'cache.bounds')))
+
+        # It is read from the sidecar without the frames.
+        for frame in xrange(1, 4):
+            os.unlink(os.path.join(self.sandbox, 'cacheFrame%d.mc' % frame))
+        loaded = bounds.get_bounds(self.xml_path, compute=False)
+        self.assertEqual(loaded.channel_names, ['a', 'b'])
+        self.assertEqual(list(loaded.times), list(index.times))
+        self.assertEqual(loaded.get_bounds('a', 750), index.get_bounds('a', 750))
+
+        # Changing the XML invalidates it.
+        os.utime(self.xml_path, (0, 0))
+        self.assertTrue(bounds.get_bounds(self.xml_path, compute=False) is None)
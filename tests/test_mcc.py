@@ -0,0 +1,441 @@
+import gc
+import os
+import shutil
+import tempfile
+import time
+import weakref
+import xml.etree.cElementTree as etree
+from unittest import TestCase
+
+from mayatools import binary
+from mayatools import mcc
+
+from helpers import requires_numpy
+
+
+def make_frame(start, channels):
+    root = binary.Node()
+    header = root.add_group('CACH')
+    header.add_chunk('VRSN').string = '0.1'
+    header.add_chunk('STIM').ints = [start]
+    header.add_chunk('ETIM').ints = [start]
+    body = root.add_group('MYCH')
+    for name, points in channels:
+        body.add_chunk('CHNM').string = name
+        body.add_chunk('SIZE').ints = [len(points)]
+        body.add_chunk('FVCA').floats = [x for point in points for x in point]
+    return root
+
+
+def make_one_file(times, channels):
+    root = binary.Node()
+    header = root.add_group('CACH')
+    header.add_chunk('VRSN').string = '0.1'
+    header.add_chunk('STIM').ints = [times[0]]
+    header.add_chunk('ETIM').ints = [times[-1]]
+    for time in times:
+        body = root.add_group('MYCH')
+        body.add_chunk('TIME').ints = [time]
+        for name, points in channels:
+            body.add_chunk('CHNM').string = name
+            body.add_chunk('SIZE').ints = [len(points)]
+            body.add_chunk('FVCA').floats = [x + time for point in points for x in point]
+    return root
+
+
+def make_xml(start, end, channels, cache_type='OneFilePerFrame', time_per_frame=250, sampling_rate=None):
+    lines = [
+        '<?xml version="1.0"?>',
+        '<Autodesk_Cache_File>',
+        '  <cacheType Type="%s" Format="mcc"/>' % cache_type,
+        '  <time Range="%d-%d"/>' % (start, end),
+        '  <cacheTimePerFrame TimePerFrame="%d"/>' % time_per_frame,
+        '  <cacheVersion Version="2.0"/>',
+        '  <Channels>',
+    ]
+    for i, name in enumerate(channels):
+        lines.append('    <channel%d ChannelName="%s" ChannelType="FloatVectorArray" ChannelInterpretation="positions" '
+            'SamplingType="Regular" SamplingRate="%d" StartTime="%d" EndTime="%d"/>' % (i, name, sampling_rate or time_per_frame, start, end))
+    lines.extend(['  </Channels>', '</Autodesk_Cache_File>', ''])
+    return '\n'.join(lines)
+
+
+class MCCTestCase(TestCase):
+
+    def setUp(self):
+        self.sandbox = tempfile.mkdtemp()
+        self._cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.sandbox, 'cache')
+        mcc._channel_cache.clear()
+
+    def tearDown(self):
+        if self._cache_home is None:
+            os.environ.pop('XDG_CACHE_HOME')
+        else:
+            os.environ['XDG_CACHE_HOME'] = self._cache_home
+        shutil.rmtree(self.sandbox)
+
+    def write_xml(self, name, start, end, channels, cache_type='OneFilePerFrame', time_per_frame=250, sampling_rate=None):
+        path = os.path.join(self.sandbox, name)
+        with open(path, 'w') as fh:
+            fh.write(make_xml(start, end, channels, cache_type, time_per_frame, sampling_rate))
+        return path
+
+    def write_frame(self, name, start, channels):
+        path = os.path.join(self.sandbox, name)
+        with open(path, 'wb') as fh:
+            make_frame(start, channels).dump(fh)
+        return path
+
+
+class TestReadFrame(MCCTestCase):
+
+    def setUp(self):
+        super(TestReadFrame, self).setUp()
+        self.path = self.write_frame('cacheFrame1.mc', 250, [
+            ('pSphereShape1', [(0, 1, 2), (3, 4, 5)]),
+            ('pCubeShape1', [(6, 7, 8)]),
+        ])
+
+    @requires_numpy
+    def test_all(self):
+        frame = mcc.read_frame(self.path)
+        self.assertEqual(sorted(frame), ['pCubeShape1', 'pSphereShape1'])
+        self.assertEqual(frame['pSphereShape1'].shape, (2, 3))
+        self.assertEqual(frame['pSphereShape1'].tolist(), [[0, 1, 2], [3, 4, 5]])
+        self.assertEqual(frame['pCubeShape1'].dtype, binary.np.dtype('>f4'))
+
+    @requires_numpy
+    def test_subset(self):
+        frame = mcc.read_frame(self.path, ['pCubeShape1'])
+        self.assertEqual(frame.keys(), ['pCubeShape1'])
+        self.assertEqual(frame['pCubeShape1'].tolist(), [[6, 7, 8]])
+        self.assertRaises(mcc.ParseError, mcc.read_frame, self.path, ['nope'])
+
+    @requires_numpy
+    def test_cache(self):
+        xml_path = self.write_xml('cache.xml', 250, 250, ['pSphereShape1', 'pCubeShape1'])
+        cache = mcc.Cache(xml_path)
+        self.assertEqual(cache.times, [250])
+        self.assertEqual(cache.channel_names, ['pSphereShape1', 'pCubeShape1'])
+        self.assertEqual(cache.channels, [('pSphereShape1', 2), ('pCubeShape1', 1)])
+        self.assertEqual(cache.read_frame(250, ['pSphereShape1'])['pSphereShape1'].tolist(), [[0, 1, 2], [3, 4, 5]])
+
+
+class TestChannelView(MCCTestCase):
+
+    def setUp(self):
+        super(TestChannelView, self).setUp()
+        self.xml_path = self.write_xml('cache.xml', 250, 1250, ['a', 'b'])
+        for frame in xrange(1, 6):
+            self.write_frame('cacheFrame%d.mc' % frame, frame * 250, [
+                ('a', [(frame, i, 0) for i in xrange(3)]),
+                ('b', [(0, 0, 0)]),
+            ])
+        self.reads = []
+        self._read_frame = mcc.read_frame
+        def read_frame(path, channels=None):
+            self.reads.append((os.path.basename(path), tuple(channels)))
+            return self._read_frame(path, channels)
+        mcc.read_frame = read_frame
+
+    def tearDown(self):
+        mcc.read_frame = self._read_frame
+        super(TestChannelView, self).tearDown()
+
+    @requires_numpy
+    def test_sub_frames(self):
+        xml_path = self.write_xml('sub.xml', 250, 500, ['a'], sampling_rate=125)
+        for time in (250, 375, 500):
+            self.write_frame(os.path.basename(mcc.get_frame_path(xml_path, time)), time, [('a', [(time, 0, 0)])])
+        cache = mcc.Cache(xml_path)
+        self.assertEqual((cache.time_per_frame, cache.sampling_rate), (250, 125))
+        view = cache.channel_view('a', prefetch=0)
+        self.assertEqual(view[:, 0, 0].tolist(), [250, 375, 500])
+        self.assertEqual(self.reads[1], ('subFrame1Tick125.mc', ('a', )))
+
+    @requires_numpy
+    def test_slice(self):
+        view = mcc.Cache(self.xml_path).channel_view('a', prefetch=2)
+        self.assertEqual(len(view), 5)
+        self.assertEqual(view[1:3, 1].tolist(), [[2, 1, 0], [3, 1, 0]])
+        view.close()
+        self.assertEqual(sorted(self.reads), [('cacheFrame2.mc', ('a', )), ('cacheFrame3.mc', ('a', ))])
+        self.assertEqual(view[[-1, 0], :, 0].tolist(), [[5, 5, 5], [1, 1, 1]])
+        view.close()
+
+    @requires_numpy
+    def test_lru(self):
+        view = mcc.Cache(self.xml_path).channel_view('a', cache_size=2, prefetch=0)
+        self.assertEqual(view.shape, (5, 3, 3))
+        self.assertEqual(view[4][0].tolist(), [5, 0, 0])
+        self.assertEqual(view[0, 0, 0], 1)
+        view[1]
+        self.assertEqual(sorted(view._frames), [0, 1])
+        self.assertEqual(len(self.reads), 3)
+        self.assertEqual(binary.np.asarray(view).shape, (5, 3, 3))
+        self.assertRaises(IndexError, view.__getitem__, 5)
+
+    @requires_numpy
+    def test_prefetch(self):
+        view = mcc.Cache(self.xml_path).channel_view('a', prefetch=3)
+        view[0]
+        for i in xrange(500):
+            if len(view._frames) == 4:
+                break
+            time.sleep(0.01)
+        view.close()
+        self.assertEqual(sorted(r[0] for r in self.reads), ['cacheFrame%d.mc' % i for i in xrange(1, 5)])
+
+    @requires_numpy
+    def test_dropped(self):
+        view = mcc.Cache(self.xml_path).channel_view('a', prefetch=3)
+        view[0]
+        thread = view._thread
+        view_ref = weakref.ref(view)
+        del view
+        gc.collect()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(view_ref() is None)
+
+    @requires_numpy
+    def test_context(self):
+        with mcc.Cache(self.xml_path).channel_view('a') as view:
+            view[0]
+            thread = view._thread
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(view._frames, {})
+
+
+class TestCacheWriter(MCCTestCase):
+
+    @requires_numpy
+    def test_roundtrip(self):
+        np = binary.np
+        xml_path = os.path.join(self.sandbox, 'out.xml')
+        with mcc.CacheWriter(xml_path, extra=['written by tests']) as writer:
+            for frame in xrange(1, 4):
+                writer.write_frame(frame * 250, [
+                    ('b', np.arange(6, dtype=np.float32).reshape(2, 3) + frame),
+                    ('a', [(frame, 0, 0)]),
+                ])
+        cache = mcc.Cache(xml_path)
+        self.assertEqual(cache.times, [250, 500, 750])
+        self.assertEqual(cache.channel_names, ['b', 'a'])
+        self.assertEqual(cache.channels, [('b', 2), ('a', 1)])
+        frame = cache.read_frame(750)
+        self.assertEqual(frame['b'].tolist(), [[3, 4, 5], [6, 7, 8]])
+        self.assertEqual(frame['a'].tolist(), [[3, 0, 0]])
+        self.assertEqual(binary.scan(cache.get_frame_path(500), ['STIM', 'ETIM']), {'STIM': [(500, )], 'ETIM': [(500, )]})
+
+    @requires_numpy
+    def test_sampling_rate(self):
+        xml_path = os.path.join(self.sandbox, 'out.xml')
+        with mcc.CacheWriter(xml_path, sampling_rate=125) as writer:
+            for time in (250, 375, 500):
+                writer.write_frame(time, [('a', [(time, 0, 0)])])
+        tree = etree.parse(xml_path)
+        self.assertEqual(tree.find('cacheTimePerFrame').get('TimePerFrame'), '250')
+        channel = tree.find('Channels')[0]
+        self.assertEqual((channel.get('SamplingType'), channel.get('SamplingRate')), ('Regular', '125'))
+        self.assertTrue(os.path.exists(os.path.join(self.sandbox, 'outFrame1Tick125.mc')))
+
+    @requires_numpy
+    def test_double(self):
+        path = os.path.join(self.sandbox, 'cacheFrame1.mc')
+        mcc.write_frame(path, 250, {'a': [[0.1, 0.2, 0.3]]}, double=True)
+        array = mcc.read_frame(path)['a']
+        self.assertEqual(array.dtype, binary.np.dtype('>f8'))
+        self.assertEqual(array.tolist(), [[0.1, 0.2, 0.3]])
+
+    @requires_numpy
+    def test_mismatched_channels(self):
+        writer = mcc.CacheWriter(os.path.join(self.sandbox, 'out.xml'))
+        writer.write_frame(250, [('a', [(0, 0, 0)])])
+        self.assertRaises(ValueError, writer.write_frame, 500, [('b', [(0, 0, 0)])])
+
+
+class TestOneFile(MCCTestCase):
+
+    def setUp(self):
+        super(TestOneFile, self).setUp()
+        mcc._time_index_cache.clear()
+        self.xml_path = self.write_xml('cache.xml', 250, 750, ['a', 'bb'], cache_type='OneFile')
+        self.path = os.path.join(self.sandbox, 'cache.mc')
+        with open(self.path, 'wb') as fh:
+            make_one_file([250, 500, 750], [('a', [(0, 1, 2)]), ('bb', [(0, 0, 0), (1, 1, 1)])]).dump(fh)
+
+    def test_time_index(self):
+        index = mcc.build_time_index(self.path)
+        self.assertEqual(sorted(index), [250, 500, 750])
+        with open(self.path, 'rb') as fh:
+            offset, size = index[500]
+            fh.seek(offset)
+            self.assertEqual(fh.read(4), 'TIME')
+            fh.seek(offset - 12)
+            self.assertEqual(fh.read(4), 'FOR4')
+        self.assertEqual(mcc.get_time_index(self.path), index)
+
+        # From disk, when it isn't in memory.
+        mcc._time_index_cache.clear()
+        original = mcc.build_time_index
+        mcc.build_time_index = None
+        try:
+            self.assertEqual(mcc.get_time_index(self.path), index)
+        finally:
+            mcc.build_time_index = original
+
+    def test_parse_time_group(self):
+        index = mcc.build_time_index(self.path)
+        with open(self.path, 'rb') as fh:
+            group = mcc.parse_time_group(fh, index[500])
+            self.assertEqual(group.find_one('TIME').ints[0], 500)
+            channels = [(name, size, chunk.tag) for name, size, chunk in mcc.iter_channels(group)]
+            self.assertEqual(channels, [('a', 1, 'FVCA'), ('bb', 2, 'FVCA')])
+            offset, size = index[500]
+            self.assertRaises(mcc.ParseError, mcc.parse_time_group, fh, (offset + 8, size))
+
+    def test_get_channels(self):
+        # Only the headers of the point data are read.
+        sizes = []
+        original = binary.Parser._read_at
+        def _read_at(parser, offset, size):
+            sizes.append(size)
+            return original(parser, offset, size)
+        binary.Parser._read_at = _read_at
+        try:
+            self.assertEqual(mcc.get_channels(self.xml_path), [('a', 1), ('bb', 2)])
+        finally:
+            binary.Parser._read_at = original
+        self.assertTrue(sizes)
+        self.assertTrue(max(sizes) <= 4, sizes)
+
+    def test_per_frame_with_stray_mc(self):
+        # The XML, not the files beside it, says what kind of cache it is.
+        xml_path = self.write_xml('cache.xml', 250, 250, ['c'])
+        self.write_frame('cacheFrame1.mc', 250, [('c', [(0, 0, 0)] * 3)])
+        with open(os.path.join(self.sandbox, 'cache.mc'), 'wb') as fh:
+            fh.write('not a cache')
+        self.assertEqual(mcc.get_channels(xml_path), [('c', 3)])
+
+    @requires_numpy
+    def test_read(self):
+        frame = mcc.read_time(self.path, 500)
+        self.assertEqual(frame['a'].tolist(), [[500, 501, 502]])
+        self.assertEqual(frame['bb'].tolist(), [[500, 500, 500], [501, 501, 501]])
+        self.assertEqual(mcc.read_time(self.path, 750, ['bb']).keys(), ['bb'])
+        self.assertRaises(KeyError, mcc.read_time, self.path, 1000)
+        cache = mcc.Cache(self.xml_path)
+        self.assertEqual(cache.read_frame(250)['a'].tolist(), [[250, 251, 252]])
+        view = cache.channel_view('a', prefetch=0)
+        self.assertEqual(view[:, 0, 0].tolist(), [250, 500, 750])
+
+
+class TestGetChannels(MCCTestCase):
+
+    def test_basics(self):
+        self.write_frame('cacheFrame1.mc', 250, [
+            ('pSphereShape1', [(0, 0, 0)] * 5),
+            ('pCubeShape1', [(1, 2, 3)] * 8),
+        ])
+        xml_path = os.path.join(self.sandbox, 'cache.xml')
+        channels = mcc.get_channels(xml_path)
+        self.assertEqual(channels, [('pSphereShape1', 5), ('pCubeShape1', 8)])
+        self.assertEqual(mcc.get_channels(xml_path), channels)
+
+    def test_cache(self):
+        path = self.write_frame('cacheFrame1.mc', 250, [('pSphereShape1', [(0, 0, 0)] * 5)])
+        xml_path = os.path.join(self.sandbox, 'cache.xml')
+        channels = mcc.get_channels(xml_path)
+        self.assertEqual(channels, [('pSphereShape1', 5)])
+        self.assertEqual(map(type, channels[0]), [str, int])
+
+        # From disk, when it isn't in memory.
+        mcc._channel_cache.clear()
+        original_parser = binary.Parser
+        binary.Parser = None
+        try:
+            channels = mcc.get_channels(xml_path)
+        finally:
+            binary.Parser = original_parser
+        self.assertEqual(channels, [('pSphereShape1', 5)])
+        self.assertEqual(map(type, channels[0]), [str, int])
+        self.assertTrue(path in mcc._channel_cache)
+
+        # Changing the file invalidates it.
+        self.write_frame('cacheFrame1.mc', 250, [('pCubeShape1', [(0, 0, 0)] * 8)])
+        os.utime(path, (0, 0))
+        self.assertEqual(mcc.get_channels(xml_path), [('pCubeShape1', 8)])
+
+    def test_lru(self):
+        original_size = mcc.channel_cache_size
+        mcc.channel_cache_size = 2
+        try:
+            for i in xrange(3):
+                os.mkdir(os.path.join(self.sandbox, str(i)))
+                self.write_frame(os.path.join(str(i), 'cacheFrame1.mc'), 250, [('pSphereShape1', [(0, 0, 0)] * 5)])
+                mcc.get_channels(os.path.join(self.sandbox, str(i), 'cache.xml'))
+            self.assertEqual(sorted(os.path.basename(os.path.dirname(p)) for p in mcc._channel_cache), ['1', '2'])
+        finally:
+            mcc.channel_cache_size = original_size
+
+    def test_first_frame_from_xml(self):
+        xml_path = os.path.join(self.sandbox, 'cache.xml')
+        with open(xml_path, 'w') as fh:
+            fh.write('<Autodesk_Cache_File><time Range="500-750"/></Autodesk_Cache_File>')
+        self.write_frame('cacheFrame1.mc', 250, [('stale', [(0, 0, 0)])])
+        self.write_frame('cacheFrame2.mc', 500, [('pSphereShape1', [(0, 0, 0)] * 5)])
+        mcc._listing_cache.clear()
+        self.assertEqual(mcc.get_first_frame_path(xml_path), os.path.join(self.sandbox, 'cacheFrame2.mc'))
+        self.assertEqual(mcc._listing_cache, {})
+        self.assertEqual(mcc.get_channels(xml_path), [('pSphereShape1', 5)])
+
+    def test_first_frame_from_listing(self):
+        xml_path = os.path.join(self.sandbox, 'cache.xml')
+        for name in ('cacheFrame10.mc', 'cacheFrame9Tick125.mc', 'cacheFrame9.mc', 'otherFrame1.mc'):
+            open(os.path.join(self.sandbox, name), 'wb').close()
+        self.assertEqual(mcc.get_first_frame_path(xml_path), os.path.join(self.sandbox, 'cacheFrame9.mc'))
+        self.assertTrue(self.sandbox in mcc._listing_cache)
+
+    def test_frame_path(self):
+        self.assertEqual(mcc.get_frame_path('/a/cache.xml', 250), '/a/cacheFrame1.mc')
+        self.assertEqual(mcc.get_frame_path('/a/cache.xml', 375), '/a/cacheFrame1Tick125.mc')
+
+    def test_30fps(self):
+        xml_path = self.write_xml('cache.xml', 200, 400, ['pSphereShape1'], time_per_frame=200)
+        for frame in (1, 2):
+            self.write_frame('cacheFrame%d.mc' % frame, frame * 200, [('pSphereShape1', [(0, 0, 0)] * 5)])
+        self.write_frame('cacheFrame2Tick100.mc', 500, [('pSphereShape1', [(0, 0, 0)] * 5)])
+        self.assertEqual(mcc.get_frame_path(xml_path, 200), os.path.join(self.sandbox, 'cacheFrame1.mc'))
+        self.assertEqual(mcc.get_frame_path(xml_path, 100, 200), os.path.join(self.sandbox, 'cacheFrame0Tick100.mc'))
+        self.assertEqual(mcc.get_frame_times(xml_path), [200, 400, 500])
+        self.assertEqual(mcc.get_first_frame_path(xml_path), os.path.join(self.sandbox, 'cacheFrame1.mc'))
+        cache = mcc.Cache(xml_path)
+        self.assertEqual(cache.frame_times, [200, 400, 500])
+        self.assertEqual(cache.get_frame_path(400), os.path.join(self.sandbox, 'cacheFrame2.mc'))
+        if binary.np is not None:
+            self.assertEqual(cache.read_frame(400)['pSphereShape1'].shape, (5, 3))
+
+    def test_missing(self):
+        self.assertRaises(mcc.ParseError, mcc.get_channels, os.path.join(self.sandbox, 'cache.xml'))
+
+
+class TestDuplicateFrames(MCCTestCase):
+
+    def test_find_and_link(self):
+        still = [('pSphereShape1', [(0, 0, 0)] * 5)]
+        moved = [('pSphereShape1', [(1, 0, 0)] * 5)]
+        a = self.write_frame('cacheFrame1.mc', 250, still)
+        b = self.write_frame('cacheFrame2.mc', 500, still)
+        c = self.write_frame('cacheFrame3.mc', 750, moved)
+        d = self.write_frame('cacheFrame4.mc', 500, still)
+
+        self.assertEqual(mcc.find_duplicate_frames(self.sandbox), [[b, d]])
+        self.assertEqual(mcc.find_duplicate_frames(self.sandbox, ignore_tags=('STIM', 'ETIM')), [[a, b, d]])
+
+        self.assertEqual(mcc.link_duplicate_frames(self.sandbox, dry_run=True), [(b, d)])
+        self.assertFalse(os.path.samefile(b, d))
+        self.assertEqual(mcc.link_duplicate_frames(self.sandbox), [(b, d)])
+        self.assertTrue(os.path.samefile(b, d))
+        self.assertEqual(mcc.link_duplicate_frames(self.sandbox), [])